@@ -15,6 +15,26 @@ class CustomSalesInvoice(SalesInvoice):
 		
 		# Set custom_payment_status based on due date
 		self.set_custom_payment_status()
+		self.set_late_fined_through()
+	
+	def make_gl_entries(self, gl_entries=None, from_repost=False):
+		"""Hand the GL map to a bulk submit's buffer instead of posting it right away.
+
+		The buffer is set by eduction_override.fees.bulk_submit, which writes the
+		entries of a whole chunk of invoices together.
+		"""
+		if self.flags.gl_entry_buffer is None or self.docstatus != 1 or from_repost:
+			return super().make_gl_entries(gl_entries=gl_entries, from_repost=from_repost)
+
+		self.flags.gl_entry_buffer.append((self.name, gl_entries or self.get_gl_entries()))
+	
+	def set_late_fined_through(self):
+		"""Start the late fine watermark at the due date; fines are billed for the days after it."""
+		if not self.get("custom_has_late_fine") or not self.due_date or not self.meta.has_field("custom_late_fined_through"):
+			return
+		
+		if not self.custom_late_fined_through or getdate(self.custom_late_fined_through) < getdate(self.due_date):
+			self.custom_late_fined_through = self.due_date
 	
 	def set_custom_payment_status(self):
 		"""Set custom_payment_status to Overdue if due date has passed and invoice is not paid."""
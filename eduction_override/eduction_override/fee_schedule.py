@@ -1,4 +1,5 @@
 import frappe
+from frappe import _
 from frappe.query_builder import DocType
 from frappe.query_builder.functions import Sum
 
@@ -6,6 +7,25 @@ from education.education.doctype.fee_schedule.fee_schedule import FeeSchedule
 
 
 class CustomFeeSchedule(FeeSchedule):
+	@frappe.whitelist()
+	def create_fees(self):
+		"""Override to refuse schedules whose invoices are created per student by a bulk run.
+
+		Checked here, before education sets the status to In Process and queues
+		generate_fees, so a refused schedule is not left In Process.
+		"""
+		from eduction_override.fees.consolidated_invoices import get_consolidated_run
+
+		consolidated_run = get_consolidated_run(self.name)
+		if consolidated_run:
+			frappe.throw(
+				_("Invoices of Fee Schedule {0} are created per student by Bulk Fee Invoice Creation {1}").format(
+					self.name, consolidated_run
+				)
+			)
+
+		return super().create_fees()
+
 	def validate_total_against_fee_strucuture(self):
 		"""Override to disable validation - allow creating fee schedules above fee structure limit.
 		This method intentionally does nothing to bypass the base class validation.
@@ -23,20 +43,26 @@ class CustomFeeSchedule(FeeSchedule):
 	def calculate_total_and_program(self):
 		"""Override to use simple student count (same as bulk creation) instead of requiring Program Enrollment.
 		This ensures student counts match the values shown in bulk creation.
+		Counts and programs come from the shared Student Group cache, so repeated saves don't hit the DB.
 		"""
-		import frappe
 		from frappe.utils import cint, money_in_words
+
+		from eduction_override.fees.student_counts import get_student_group_summaries
+		
+		# Counts already computed by the caller (e.g. Bulk Fee Invoice Creation)
+		student_counts = self.flags.get("student_counts") or {}
+		summaries = get_student_group_summaries(d.student_group for d in self.student_groups)
 		
 		no_of_students = 0
 		for d in self.student_groups:
+			summary = summaries.get(d.student_group) or frappe._dict()
+			
 			# Use simple count of active students (same method as bulk creation)
 			# This doesn't require Program Enrollment, so it will always return accurate counts
-			if d.student_group:
-				student_count = frappe.db.count(
-					"Student Group Student",
-					filters={"parent": d.student_group, "active": 1}
-				)
-				d.total_students = cint(student_count) or 0
+			if d.student_group in student_counts:
+				d.total_students = cint(student_counts[d.student_group])
+			elif d.student_group:
+				d.total_students = cint(summary.total_students)
 			else:
 				d.total_students = 0
 			
@@ -44,9 +70,7 @@ class CustomFeeSchedule(FeeSchedule):
 			
 			# Validate the program of fee structure and student groups
 			if d.student_group:
-				student_group_program = frappe.db.get_value(
-					"Student Group", d.student_group, "program"
-				)
+				student_group_program = summary.program
 				if self.program and student_group_program and self.program != student_group_program:
 					frappe.msgprint(
 						_("Program in the Fee Structure and Student Group {0} are different.").format(
@@ -56,4 +80,3 @@ class CustomFeeSchedule(FeeSchedule):
 		
 		self.grand_total = no_of_students * self.total_amount
 		self.grand_total_in_words = money_in_words(self.grand_total)
-
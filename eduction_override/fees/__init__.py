@@ -3,12 +3,13 @@
 
 # Monkey patch the create_sales_invoice function when this module is imported
 def patch_create_sales_invoice():
-	"""Patch the create_sales_invoice function in fee_schedule module."""
+	"""Patch the create_sales_invoice and generate_fees functions in fee_schedule module."""
 	from eduction_override.fees import fee_schedule_override
 	import education.education.doctype.fee_schedule.fee_schedule as fee_schedule_module
 	
-	# Replace the original function with our override
+	# Replace the original functions with our overrides
 	fee_schedule_module.create_sales_invoice = fee_schedule_override.create_sales_invoice
+	fee_schedule_module.generate_fees = fee_schedule_override.generate_fees
 
 # Apply the patch
 patch_create_sales_invoice()
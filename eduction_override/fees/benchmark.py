@@ -0,0 +1,191 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+"""Throughput benchmark for the fee billing pipeline.
+
+Generates a synthetic school (programs x sections x students, enrolled and billed
+with one Fee Structure), then times every stage of billing it and counts the
+queries each stage runs:
+
+	bench --site <site> execute eduction_override.fees.benchmark.run \
+		--kwargs "{'programs': 10, 'sections': 4, 'students': 40}"
+
+Run it on a dedicated test site: the late fine stage processes every overdue draft
+invoice of the site, not only the synthetic ones. Results are stored per app
+version and parameters in <site>/benchmarks/eduction_override.json and every run
+is compared with the stored result of the previous version that used the same
+parameters.
+"""
+
+import json
+import os
+import time
+
+import frappe
+from frappe.utils import flt, now
+
+import eduction_override
+from eduction_override.tests.utils import SyntheticSchool
+
+BENCHMARK_RESULTS_FILE = "eduction_override.json"
+
+
+def run(
+	programs=3,
+	sections=2,
+	students=20,
+	days_overdue=5,
+	fee_structure=None,
+	company=None,
+	academic_year=None,
+	keep_data=False,
+):
+	"""Create a synthetic school, bill it stage by stage and store the timings.
+
+	fee_structure is a submitted Fee Structure used as template for the school's
+	own Fee Structure (defaults to the latest one). Invoices are due days_overdue
+	days ago with a daily late fine, so the late fine stage has work to do. The
+	synthetic data is deleted afterwards unless keep_data is set.
+	"""
+	params = {
+		"programs": int(programs),
+		"sections": int(sections),
+		"students": int(students),
+		"days_overdue": int(days_overdue),
+	}
+
+	# Generate invoices inline so that the whole run is timed in this process
+	frappe.local.conf.fee_invoice_shard_size = params["programs"] * params["sections"] * params["students"] + 1
+
+	school = SyntheticSchool(
+		fee_structure=fee_structure, company=company, academic_year=academic_year, **params
+	)
+	try:
+		school.make()
+		stages = bill(school)
+	finally:
+		if not keep_data:
+			school.delete()
+		frappe.db.commit()
+
+	result = {
+		"version": eduction_override.__version__,
+		"timestamp": now(),
+		"params": params,
+		"stages": stages,
+	}
+	previous = save_result(result)
+	print_result(result, previous)
+	return result
+
+
+class QueryCounter:
+	"""Count the queries sent through frappe.db.sql while the context is active."""
+
+	def __enter__(self):
+		self.count = 0
+		self._sql = frappe.db.sql
+
+		def sql(*args, **kwargs):
+			self.count += 1
+			return self._sql(*args, **kwargs)
+
+		frappe.db.sql = sql
+		return self
+
+	def __exit__(self, *exc):
+		frappe.db.sql = self._sql
+
+
+def measure(func, *args, **kwargs):
+	"""Run func and return ({"seconds", "queries"}, return value)."""
+	with QueryCounter() as counter:
+		start = time.perf_counter()
+		value = func(*args, **kwargs)
+		seconds = time.perf_counter() - start
+	return {"seconds": round(seconds, 3), "queries": counter.count}, value
+
+
+def bill(school):
+	"""Run every billing stage on the school's bulk run and return the measurements by stage."""
+	from eduction_override.fees.fee_schedule_override import generate_fees
+	from eduction_override.fees.tasks import process_late_fines_for_overdue_invoices
+
+	stages = {}
+	doc = frappe.get_doc("Bulk Fee Invoice Creation", school.bulk_run.name)
+	stages["calculate_summary"], _ = measure(doc.calculate_summary)
+	stages["create_fee_schedules"], created = measure(doc.create_fee_schedules, run_in_background=0)
+	frappe.db.commit()
+
+	fee_schedules = created["schedules"]
+	for name in fee_schedules:
+		school.track_name("Fee Schedule", name)
+	stages["submit_fee_schedules"], _ = measure(school.submit_fee_schedules, fee_schedules)
+
+	def generate_all_fees():
+		for name in fee_schedules:
+			generate_fees(name)
+
+	stages["generate_fees"], _ = measure(generate_all_fees)
+	school.created["Sales Invoice"] = frappe.get_all(
+		"Sales Invoice", filters={"fee_schedule": ["in", fee_schedules or [""]]}, pluck="name"
+	)
+
+	stages["process_late_fines"], _ = measure(process_late_fines_for_overdue_invoices)
+	frappe.db.commit()
+
+	stages["generate_fees"]["invoices"] = len(school.created["Sales Invoice"])
+	return stages
+
+
+def get_results_path():
+	return frappe.get_site_path("benchmarks", BENCHMARK_RESULTS_FILE)
+
+
+def load_results():
+	path = get_results_path()
+	if not os.path.exists(path):
+		return {}
+	with open(path) as f:
+		return json.load(f)
+
+
+def get_result_key(result):
+	"""Return the key a result is stored under: its app version and parameters."""
+	return "{0} {1}".format(result["version"], json.dumps(result["params"], sort_keys=True))
+
+
+def save_result(result):
+	"""Store the result under its version and parameters; return the previous result to compare with.
+
+	Only results with the same parameters are comparable. The previous result is the
+	latest stored one for another version, or else an earlier run of this version.
+	"""
+	results = load_results()
+	comparable = [
+		d for d in results.values() if d["params"] == result["params"]
+	]
+	other_versions = [d for d in comparable if d["version"] != result["version"]]
+	previous = max(other_versions or comparable, key=lambda d: d["timestamp"], default=None)
+
+	results[get_result_key(result)] = result
+	path = get_results_path()
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "w") as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+
+	return previous
+
+
+def print_result(result, previous=None):
+	print(f"eduction_override {result['version']} {result['params']}")
+	for stage, measured in result["stages"].items():
+		line = f"  {stage:<24} {measured['seconds']:>9.3f}s {measured['queries']:>8} queries"
+		before = previous and previous["stages"].get(stage)
+		if before:
+			line += "   vs {0}: {1:+.1%} time, {2:+d} queries".format(
+				previous["version"],
+				flt(measured["seconds"] - before["seconds"]) / (before["seconds"] or 1),
+				measured["queries"] - before["queries"],
+			)
+		print(line)
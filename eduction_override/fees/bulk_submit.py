@@ -0,0 +1,325 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import cint, cstr, flt, getdate, now
+
+from eduction_override.fees.invoice_bulk_insert import insert_rows
+
+# Number of invoices submitted and committed by one background job. Can be changed
+# per site with the "fee_invoice_submit_chunk_size" key in site_config.json.
+DEFAULT_SUBMIT_CHUNK_SIZE = 100
+
+# Counter of the finished chunks of each submit run; the last chunk queues the fee
+# notifications of the run. The counter expires after a day, so a run whose chunk
+# died doesn't leave it behind.
+SUBMIT_RUN_CACHE = "eduction_override:fee_invoice_submit_run"
+SUBMIT_RUN_EXPIRY = 24 * 60 * 60
+
+
+@frappe.whitelist()
+def submit_fee_invoices(fee_schedule=None, bulk_fee_invoice_creation=None):
+	"""Submit the draft invoices of a Fee Schedule or of a Bulk Fee Invoice Creation run.
+
+	The invoices are split into chunks, each submitted by its own job on the long
+	queue. Progress is published to the user as "fee_invoice_submit_progress". Once
+	every chunk is done, the invoices are emailed (see submit_invoice_chunk).
+	"""
+	if not (fee_schedule or bulk_fee_invoice_creation):
+		frappe.throw(_("Select a Fee Schedule or a Bulk Fee Invoice Creation"))
+	frappe.has_permission("Sales Invoice", "submit", throw=True)
+
+	fee_schedules = get_fee_schedules(fee_schedule, bulk_fee_invoice_creation)
+	invoices = frappe.get_all(
+		"Sales Invoice",
+		filters={"fee_schedule": ["in", fee_schedules or [""]], "docstatus": 0},
+		order_by="fee_schedule, name",
+		pluck="name",
+	)
+	if not invoices:
+		frappe.throw(_("There are no draft invoices to submit"))
+
+	chunk_size = cint(frappe.conf.get("fee_invoice_submit_chunk_size")) or DEFAULT_SUBMIT_CHUNK_SIZE
+	chunks = [invoices[start : start + chunk_size] for start in range(0, len(invoices), chunk_size)]
+	run_id = frappe.generate_hash(length=10)
+
+	cache = frappe.cache()
+	cache.set(cache.make_key(f"{SUBMIT_RUN_CACHE}:{run_id}"), 0, ex=SUBMIT_RUN_EXPIRY)
+
+	for chunk in chunks:
+		frappe.enqueue(
+			"eduction_override.fees.bulk_submit.submit_invoice_chunk",
+			queue="long",
+			timeout=3000,
+			enqueue_after_commit=True,
+			invoices=chunk,
+			total=len(invoices),
+			user=frappe.session.user,
+			run_id=run_id,
+			chunk_count=len(chunks),
+			fee_schedule=fee_schedule,
+			bulk_fee_invoice_creation=bulk_fee_invoice_creation,
+		)
+
+	return {"invoices": len(invoices), "chunks": len(chunks)}
+
+
+def get_fee_schedules(fee_schedule=None, bulk_fee_invoice_creation=None):
+	"""Return the Fee Schedule, or the Fee Schedules created by a Bulk Fee Invoice Creation run."""
+	if fee_schedule:
+		return [fee_schedule]
+	return frappe.get_all(
+		"Bulk Fee Invoice Creation Fee Schedule",
+		filters={"parent": bulk_fee_invoice_creation, "fee_schedule": ["is", "set"]},
+		pluck="fee_schedule",
+	)
+
+
+def submit_invoice_chunk(
+	invoices,
+	total,
+	user=None,
+	run_id=None,
+	chunk_count=None,
+	fee_schedule=None,
+	bulk_fee_invoice_creation=None,
+):
+	"""Background job: submit one chunk of draft invoices and commit it.
+
+	The last chunk of the run to finish queues the fee notifications of the Fee
+	Schedule or bulk run, so each student gets one email for all their invoices.
+	"""
+	from eduction_override.fees.notifications import enqueue_fee_notifications
+
+	submitted, failures = submit_invoices(invoices)
+	frappe.db.commit()
+
+	if run_id:
+		cache = frappe.cache()
+		# Atomic, so exactly one chunk sees the final count
+		if cache.incr(cache.make_key(f"{SUBMIT_RUN_CACHE}:{run_id}")) == chunk_count:
+			enqueue_fee_notifications(fee_schedule, bulk_fee_invoice_creation)
+			frappe.db.commit()
+
+	if failures:
+		frappe.log_error(
+			title=_("{0} fee invoices could not be submitted").format(len(failures)),
+			message="\n".join(f"{d.invoice}: {d.error}" for d in failures),
+		)
+
+	frappe.publish_realtime(
+		"fee_invoice_submit_progress",
+		{"submitted": len(submitted), "failed": len(failures), "total": total},
+		user=user,
+	)
+
+
+def submit_invoices(invoices, defer_gl_entries=True):
+	"""Submit draft Sales Invoices, posting most of their ledger entries in bulk.
+
+	The first invoice of every Fee Schedule in the chunk is submitted the normal way.
+	The GL maps of the others are buffered (see CustomSalesInvoice.make_gl_entries)
+	and written by post_gl_entries_in_bulk, which runs the checks of make_gl_entries
+	and GL Entry once for every distinct posting date, account, party and dimensions.
+	If that fails, the chunk is rolled back and submitted again one invoice at a time.
+	Returns (submitted, failures).
+	"""
+	frappe.db.savepoint("fee_invoice_submit_chunk")
+
+	buffer = []
+	posted_schedules = set()
+	submitted = []
+	failures = []
+	for name in invoices:
+		frappe.db.savepoint("fee_invoice_submit")
+		try:
+			doc = frappe.get_doc("Sales Invoice", name)
+			if doc.docstatus != 0:
+				continue
+
+			defer = defer_gl_entries and doc.fee_schedule in posted_schedules and can_defer_gl_entries(doc)
+			if defer:
+				doc.flags.gl_entry_buffer = buffer
+			doc.submit()
+
+			submitted.append(name)
+			if not defer:
+				posted_schedules.add(doc.fee_schedule)
+		except Exception as e:
+			frappe.db.rollback(save_point="fee_invoice_submit")
+			buffer[:] = [d for d in buffer if d[0] != name]
+			failures.append(
+				frappe._dict(
+					invoice=name,
+					error=(frappe.local.message_log and "\n".join(cstr(m) for m in frappe.local.message_log))
+					or cstr(e),
+				)
+			)
+			frappe.local.message_log = []
+
+	if buffer:
+		try:
+			post_gl_entries_in_bulk(buffer)
+		except Exception:
+			frappe.db.rollback(save_point="fee_invoice_submit_chunk")
+			frappe.log_error(title="Bulk GL posting failed, submitting fee invoices one by one")
+			return submit_invoices(invoices, defer_gl_entries=False)
+
+	return submitted, failures
+
+
+def can_defer_gl_entries(doc):
+	"""Whether the invoice's ledger entries are plain enough to be posted in bulk.
+
+	Invoices that touch stock, payments, advances or write-offs post (or update)
+	more than their own GL map and keep going through erpnext's make_gl_entries.
+	"""
+	return not (
+		cint(doc.is_pos)
+		or cint(doc.update_stock)
+		or cint(doc.is_return)
+		or cint(doc.redeem_loyalty_points)
+		or flt(doc.write_off_amount)
+		or doc.get("advances")
+	)
+
+
+def post_gl_entries_in_bulk(buffer):
+	"""Write buffered (invoice, GL map) pairs with one INSERT per ledger.
+
+	Each GL map is processed and balanced the way erpnext's make_gl_entries does it,
+	and validated by validate_accounting_controls and validate_gl_entries. The Payment
+	Ledger Entries are built from the same maps. Outstanding amounts are not
+	recalculated: a fresh invoice without advances already carries its total.
+	"""
+	from erpnext.accounts.doctype.gl_entry.gl_entry import validate_balance_type
+	from erpnext.accounts.general_ledger import (
+		make_acc_dimensions_offsetting_entry,
+		process_debit_credit_difference,
+		process_gl_map,
+	)
+	from erpnext.accounts.utils import get_payment_ledger_entries
+
+	offsetting_companies = get_offsetting_dimension_companies()
+	gl_entries = []
+	payment_ledger_entries = []
+	for _invoice, gl_map in buffer:
+		if gl_map and gl_map[0].company in offsetting_companies:
+			make_acc_dimensions_offsetting_entry(gl_map)
+		gl_map = process_gl_map(gl_map, merge_entries=False)
+		process_debit_credit_difference(gl_map)
+		gl_entries.extend(gl_map)
+		payment_ledger_entries.extend(get_payment_ledger_entries(gl_map, cancel=0))
+
+	validate_accounting_controls(gl_entries)
+	validate_gl_entries(gl_entries)
+	insert_submitted_entries("GL Entry", gl_entries)
+	insert_submitted_entries("Payment Ledger Entry", payment_ledger_entries)
+
+	# GL Entry checks the balance type in on_update, so with the new entries included
+	for account in {entry.account for entry in gl_entries}:
+		validate_balance_type(account)
+
+
+def get_offsetting_dimension_companies():
+	"""Companies with accounting dimensions that post balancing entries (see make_acc_dimensions_offsetting_entry)."""
+	return set(
+		frappe.get_all(
+			"Accounting Dimension Detail",
+			filters={"automatically_post_balancing_accounting_entry": 1},
+			pluck="company",
+		)
+	)
+
+
+def validate_accounting_controls(gl_entries):
+	"""Run the voucher checks of erpnext's make_gl_entries once for every company and posting date.
+
+	Disabled accounts, closed accounting periods, the accounts frozen date and
+	period closing vouchers only depend on the accounts, company, posting date and
+	opening flag of the entries, so one entry of each combination is checked.
+	"""
+	from erpnext.accounts.general_ledger import (
+		check_freezing_date,
+		validate_accounting_period,
+		validate_against_pcv,
+		validate_disabled_accounts,
+	)
+
+	validate_disabled_accounts(gl_entries)
+
+	vouchers = {}
+	for entry in gl_entries:
+		key = (
+			entry.company,
+			getdate(entry.posting_date),
+			entry.voucher_type,
+			entry.get("is_opening") == "Yes",
+		)
+		vouchers.setdefault(key, entry)
+
+	for (company, posting_date, _voucher_type, is_opening), entry in vouchers.items():
+		validate_accounting_period([entry])
+		check_freezing_date(posting_date)
+		validate_against_pcv(is_opening, posting_date, company)
+
+
+def validate_gl_entries(gl_entries):
+	"""Run the checks of saving a GL Entry once for every distinct account, party and dimensions.
+
+	Entries are written without going through GL Entry's validate and on_update, so
+	mandatory fields, party, frozen or disabled accounts and accounting dimensions
+	are checked here on one entry of each combination; every customer is checked.
+	The fiscal year, which GL Entry's validate sets, is set on every entry.
+	"""
+	from erpnext.accounts.doctype.accounting_dimension.accounting_dimension import get_accounting_dimensions
+	from erpnext.accounts.doctype.gl_entry.gl_entry import (
+		validate_frozen_account,
+		validate_party_frozen_disabled,
+	)
+	from erpnext.accounts.utils import get_fiscal_year
+
+	dimensions = ["cost_center", "project", *get_accounting_dimensions()]
+	validated = set()
+	accounts = set()
+	for entry in gl_entries:
+		if not entry.get("fiscal_year"):
+			entry.fiscal_year = get_fiscal_year(entry.posting_date, company=entry.company)[0]
+
+		if entry.account not in accounts:
+			accounts.add(entry.account)
+			validate_frozen_account(entry.account)
+
+		key = (entry.account, entry.party_type, entry.party, *(entry.get(d) for d in dimensions))
+		if key in validated:
+			continue
+		validated.add(key)
+
+		doc = frappe.new_doc("GL Entry")
+		doc.update(entry)
+		doc.validate()
+		doc.validate_account_details(adv_adj=False)
+		doc.validate_dimensions_for_pl_and_bs()
+		doc.validate_allowed_dimensions()
+		validate_party_frozen_disabled(doc.party_type, doc.party)
+
+
+def insert_submitted_entries(doctype, entries):
+	"""Insert ledger entries as submitted documents with a single multi-row INSERT."""
+	if not entries:
+		return
+
+	timestamp = now()
+	user = frappe.session.user
+	rows = []
+	for entry in entries:
+		doc = frappe.new_doc(doctype)
+		doc.update(entry)
+		doc.set_new_name()
+		doc.docstatus = 1
+		doc.owner = doc.modified_by = user
+		doc.creation = doc.modified = timestamp
+		rows.append(doc.get_valid_dict(convert_dates_to_str=True, ignore_nulls=False))
+
+	insert_rows(doctype, rows)
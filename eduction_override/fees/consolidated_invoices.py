@@ -0,0 +1,199 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import getdate
+
+from eduction_override.fees.bulk_submit import get_fee_schedules
+from eduction_override.fees.doctype.fee_invoice_failure.fee_invoice_failure import record_invoice_failures
+from eduction_override.fees.fee_schedule_override import (
+	FeeInvoiceBuilder,
+	generate_invoices,
+	get_invoiced_students,
+	get_student_customers,
+)
+
+
+class ConsolidatedInvoiceBuilder:
+	"""Build one draft Sales Invoice per student for all Fee Schedules of a bulk run.
+
+	Students are grouped by the run's schedules in a single pass (get_student_schedules).
+	A student's invoice starts from the template of their first schedule, and the
+	items of their other schedules are appended; every item keeps its schedule in
+	custom_fee_schedule. Templates are built once per schedule.
+	"""
+
+	# Students have different sets of schedules, so invoices can't be copies of one
+	allow_bulk_insert = False
+
+	def __init__(self, bulk_fee_invoice_creation):
+		self.bulk_fee_invoice_creation = bulk_fee_invoice_creation
+		self.fee_schedules = get_fee_schedules(bulk_fee_invoice_creation=bulk_fee_invoice_creation)
+		self.student_schedules, self.students = get_student_schedules(self.fee_schedules)
+		self.builders = {}
+
+	def get_builder(self, fee_schedule):
+		if fee_schedule not in self.builders:
+			self.builders[fee_schedule] = FeeInvoiceBuilder(fee_schedule)
+		return self.builders[fee_schedule]
+
+	def make_invoice(self, student_id, customer=None, student_name=None):
+		"""Return an unsaved Sales Invoice with the student's items from every schedule of the run."""
+		fee_schedules = self.student_schedules.get(student_id)
+		if not fee_schedules:
+			frappe.throw(_("Student {0} is not billed by {1}").format(student_id, self.bulk_fee_invoice_creation))
+
+		sales_invoice_doc = self.get_builder(fee_schedules[0]).make_invoice(
+			student_id, customer=customer, student_name=student_name
+		)
+		if len(fee_schedules) == 1:
+			return sales_invoice_doc
+
+		for fee_schedule in fee_schedules[1:]:
+			builder = self.get_builder(fee_schedule)
+			if builder.template is None:
+				builder.make_invoice(student_id, customer=sales_invoice_doc.customer, student_name=student_name)
+			for item in builder.template.items:
+				sales_invoice_doc.append("items", item.as_dict(no_default_fields=True))
+			sales_invoice_doc.due_date = min(getdate(sales_invoice_doc.due_date), getdate(builder.template.due_date))
+
+		# Let validation build the payment schedule for the combined total
+		sales_invoice_doc.set("payment_schedule", [])
+		sales_invoice_doc.calculate_taxes_and_totals()
+		return sales_invoice_doc
+
+	def record_failures(self, failures):
+		"""Record failures against each student's first schedule, where their invoice is filed."""
+		by_schedule = {}
+		for failure in failures:
+			by_schedule.setdefault(self.student_schedules[failure.student][0], []).append(failure)
+		for fee_schedule, schedule_failures in by_schedule.items():
+			record_invoice_failures(fee_schedule, schedule_failures)
+
+
+def get_student_schedules(fee_schedules):
+	"""Group the students of fee_schedules in one pass.
+
+	Students are selected the way education's get_students does for each schedule
+	(active in a Student Group of the schedule, with a submitted enrollment in its
+	academic year, term and category), but for all schedules with a single query. Returns a dict of
+	Student -> list of Fee Schedules (in run order) and the list of distinct
+	students as frappe._dicts of student and student_name.
+	"""
+	if not fee_schedules:
+		return {}, []
+
+	rows = frappe.db.sql("""
+		SELECT DISTINCT fs.name AS fee_schedule, pe.student, pe.student_name
+		FROM `tabFee Schedule` fs
+		INNER JOIN `tabFee Schedule Student Group` fsg ON fsg.parent = fs.name
+		INNER JOIN `tabStudent Group Student` sgs ON sgs.parent = fsg.student_group AND sgs.active = 1
+		INNER JOIN `tabProgram Enrollment` pe
+			ON pe.student = sgs.student AND pe.academic_year = fs.academic_year AND pe.docstatus = 1
+		WHERE fs.name IN %(fee_schedules)s
+			AND (IFNULL(fs.academic_term, '') = '' OR pe.academic_term = fs.academic_term)
+			AND (IFNULL(fs.student_category, '') = '' OR pe.student_category = fs.student_category)
+	""", {"fee_schedules": fee_schedules}, as_dict=True)
+
+	order = {name: i for i, name in enumerate(fee_schedules)}
+	rows.sort(key=lambda d: order[d.fee_schedule])
+
+	student_schedules = {}
+	students = {}
+	for row in rows:
+		schedules = student_schedules.setdefault(row.student, [])
+		if row.fee_schedule not in schedules:
+			schedules.append(row.fee_schedule)
+		students.setdefault(row.student, frappe._dict(student=row.student, student_name=row.student_name))
+
+	return student_schedules, list(students.values())
+
+
+def get_consolidated_run(fee_schedule):
+	"""Return the Bulk Fee Invoice Creation that bills fee_schedule with one invoice per student, if any."""
+	run = frappe.db.sql("""
+		SELECT bfs.parent
+		FROM `tabBulk Fee Invoice Creation Fee Schedule` bfs
+		INNER JOIN `tabBulk Fee Invoice Creation` bfic ON bfic.name = bfs.parent
+		WHERE bfs.fee_schedule = %s AND bfic.consolidate_invoices = 1
+		LIMIT 1
+	""", fee_schedule)
+	return run[0][0] if run else None
+
+
+def validate_run_schedules(bulk_fee_invoice_creation, for_update=False):
+	"""Throw unless every Fee Schedule of the run is submitted and none has invoices being or already created.
+
+	Failed schedules can be run again; students who already have an invoice are
+	skipped then. With for_update, the schedules stay locked until the next commit.
+	"""
+	fee_schedules = get_fee_schedules(bulk_fee_invoice_creation=bulk_fee_invoice_creation)
+	if not fee_schedules:
+		frappe.throw(_("Please create the Fee Schedules first."))
+
+	schedules = frappe.db.sql("""
+		SELECT name, docstatus, status
+		FROM `tabFee Schedule`
+		WHERE name IN %(fee_schedules)s
+		{for_update}
+	""".format(for_update="FOR UPDATE" if for_update else ""), {"fee_schedules": fee_schedules}, as_dict=True)
+
+	not_submitted = [d.name for d in schedules if d.docstatus != 1]
+	if not_submitted:
+		frappe.throw(_("Please submit the Fee Schedules of {0} first: {1}").format(
+			bulk_fee_invoice_creation, ", ".join(not_submitted)
+		))
+
+	started = [d.name for d in schedules if d.status in ("In Process", "Invoice Created")]
+	if started:
+		frappe.throw(_("Invoices are already being created or were created for: {0}").format(", ".join(started)))
+
+
+def generate_consolidated_invoices(bulk_fee_invoice_creation, user=None):
+	"""Background job: create one invoice per student for every Fee Schedule of a bulk run."""
+	from eduction_override.fees.doctype.bulk_fee_invoice_creation.bulk_fee_invoice_creation import (
+		publish_progress,
+	)
+
+	validate_run_schedules(bulk_fee_invoice_creation, for_update=True)
+
+	builder = ConsolidatedInvoiceBuilder(bulk_fee_invoice_creation)
+	if not builder.students:
+		frappe.throw(_("Please setup Students under Student Groups"))
+
+	# A run that failed part way is run again for the students left without an invoice
+	invoiced_students = get_invoiced_students(builder.fee_schedules)
+	students = [d for d in builder.students if d.student not in invoiced_students]
+
+	# Mark the run's schedules while validate_run_schedules still holds their locks,
+	# so nothing commits (and releases them) before a second run can see the status
+	for fee_schedule in builder.fee_schedules:
+		frappe.db.set_value("Fee Schedule", fee_schedule, "status", "In Process")
+	frappe.db.commit()
+
+	student_customers = get_student_customers([d.student for d in students])
+	for student in students:
+		student.customer = (student_customers.get(student.student) or frappe._dict()).customer
+
+	progress = frappe._dict(done=0)
+
+	def publish_batch_progress(created, failures):
+		progress.done += created + len(failures)
+		publish_progress(bulk_fee_invoice_creation, progress.done * 100 / len(students), user)
+
+	failures = []
+	if students:
+		created, failures = generate_invoices(builder, students, on_batch=publish_batch_progress)
+
+	failed_schedules = {builder.student_schedules[d.student][0] for d in failures}
+	for fee_schedule in builder.fee_schedules:
+		frappe.db.set_value(
+			"Fee Schedule",
+			fee_schedule,
+			"status",
+			"Failed" if fee_schedule in failed_schedules else "Invoice Created",
+		)
+	frappe.db.commit()
+
+	publish_progress(bulk_fee_invoice_creation, 100, user, reload=True)
@@ -6,6 +6,28 @@ console.log('[Bulk Fee Invoice Creation] JavaScript file loaded');
 frappe.ui.form.on('Bulk Fee Invoice Creation', {
 	onload: function(frm) {
 		console.log('[Bulk Fee Invoice Creation] Form onload triggered');
+		
+		// Progress of background (sharded) fee schedule creation
+		frappe.realtime.off('bulk_fee_invoice_creation_progress');
+		frappe.realtime.on('bulk_fee_invoice_creation_progress', function(data) {
+			if (!data || data.name !== frm.doc.name) return;
+			
+			if (data.reload) {
+				frm.dashboard.hide_progress();
+				frm.reload_doc();
+			} else {
+				frm.dashboard.show_progress(__('Creating Fee Schedules'), data.progress, __('{0}% complete', [data.progress]));
+			}
+		});
+		
+		// Results of the background jobs started by "Submit Invoices"
+		frappe.realtime.off('fee_invoice_submit_progress');
+		frappe.realtime.on('fee_invoice_submit_progress', function(data) {
+			frappe.show_alert({
+				message: __('{0} invoices submitted, {1} failed', [data.submitted, data.failed]),
+				indicator: data.failed ? 'orange' : 'green'
+			});
+		});
 		setTimeout(function() {
 			render_rows_table(frm);
 		}, 500);
@@ -62,6 +84,60 @@ frappe.ui.form.on('Bulk Fee Invoice Creation', {
 			$(btn).prepend('<i class="fa fa-plus"></i> ');
 		}
 		
+		if (frm.doc.status === 'In Process') {
+			frm.add_custom_button(__('Reset Stale Run'), function() {
+				frappe.confirm(__('Reset this run if its background jobs have stopped? Rows not processed yet can then be created again.'), function() {
+					frm.call('reset_stale_run').then(function() {
+						frm.reload_doc();
+					});
+				});
+			});
+		}
+		
+		if (frm.doc.status === 'Completed' && frm.doc.consolidate_invoices) {
+			frm.add_custom_button(__('Create Invoices'), function() {
+				frm.call('create_consolidated_invoices').then(function() {
+					frappe.show_alert({ message: __('Creating one invoice per student in the background'), indicator: 'blue' });
+				});
+			});
+		}
+		
+		if (frm.doc.status === 'Completed') {
+			frm.add_custom_button(__('Submit Invoices'), function() {
+				frappe.confirm(__('Submit all draft invoices of this run?'), function() {
+					frappe.call({
+						method: 'eduction_override.fees.bulk_submit.submit_fee_invoices',
+						args: { bulk_fee_invoice_creation: frm.doc.name },
+						freeze: true,
+						callback: function(r) {
+							if (r.message) {
+								frappe.msgprint(__('Submitting {0} invoices in {1} background jobs', [r.message.invoices, r.message.chunks]));
+							}
+						}
+					});
+				});
+			});
+			
+			if (frm.doc.send_email) {
+				frm.add_custom_button(__('Send Fee Emails'), function() {
+					frappe.call({
+						method: 'eduction_override.fees.notifications.send_fee_notifications',
+						args: { bulk_fee_invoice_creation: frm.doc.name },
+						freeze: true,
+						callback: function() {
+							frappe.show_alert({ message: __('Fee emails will be queued in the background'), indicator: 'blue' });
+						}
+					});
+				});
+			}
+		}
+		
+		if (frm.doc.name && frm.doc.fee_structure) {
+			frm.add_custom_button(__('Preview Plan'), function() {
+				show_plan_dialog(frm);
+			});
+		}
+		
 		// If fee structure is selected, fetch and populate components
 		if (frm.doc.fee_structure) {
 			console.log('[Refresh] Fee structure found:', frm.doc.fee_structure);
@@ -236,7 +312,10 @@ frappe.ui.form.on('Bulk Fee Invoice Creation', {
 			__('This will create fee schedules for all selected sections. Do you want to continue?'),
 			function() {
 				frm.call('create_fee_schedules', {}, function(r) {
-					if (r.message) {
+					if (r.message && r.message.queued) {
+						frm.dashboard.show_progress(__('Creating Fee Schedules'), 0, __('Queued {0} row(s)', [r.message.rows]));
+						frm.reload_doc();
+					} else if (r.message) {
 						frappe.msgprint({
 							title: __('Success'),
 							message: __('Created {0} fee schedule(s)', [r.message.created]),
@@ -250,6 +329,52 @@ frappe.ui.form.on('Bulk Fee Invoice Creation', {
 	}
 });
 
+// Show what Create Fee Schedules would produce, without creating anything
+function show_plan_dialog(frm) {
+	frm.call('get_plan').then(function(r) {
+		const plan = r.message;
+		if (!plan) return;
+		
+		const format = (value) => format_currency(value, plan.currency);
+		const rows_html = plan.programs.map((row) => `
+			<tr class="${row.status === 'Completed' ? 'text-muted' : ''}">
+				<td>${frappe.utils.escape_html(row.program_name || '')}</td>
+				<td class="text-right">${row.sections}</td>
+				<td class="text-right">${row.students}</td>
+				<td class="text-right">${format(row.grand_total)}</td>
+				<td>${__(row.status)}</td>
+			</tr>
+		`).join('');
+		
+		const d = new frappe.ui.Dialog({
+			title: __('Fee Schedule Plan'),
+			size: 'large',
+			fields: [{ fieldname: 'plan_html', fieldtype: 'HTML' }],
+		});
+		d.fields_dict.plan_html.$wrapper.html(`
+			<p>
+				${__('Fee Schedules')}: <strong>${plan.fee_schedules}</strong> &nbsp;
+				${__('Invoices')}: <strong>${plan.invoices}</strong> &nbsp;
+				${__('Grand Total')}: <strong>${format(plan.grand_total)}</strong>
+				<span class="text-muted">(${format(plan.amount_per_student)} ${__('per student')})</span>
+			</p>
+			<table class="table table-bordered">
+				<thead>
+					<tr>
+						<th>${__('Program')}</th>
+						<th class="text-right">${__('Sections')}</th>
+						<th class="text-right">${__('Students')}</th>
+						<th class="text-right">${__('Grand Total')}</th>
+						<th>${__('Status')}</th>
+					</tr>
+				</thead>
+				<tbody>${rows_html}</tbody>
+			</table>
+		`);
+		d.show();
+	});
+}
+
 // Function to fetch and populate fee components from fee structure
 function fetch_and_populate_fee_components(frm, fee_structure_name) {
 	console.log('[fetch_and_populate_fee_components] ===== FUNCTION CALLED =====');
@@ -418,34 +543,6 @@ function open_add_row_dialog(frm, row_name = null) {
 		primary_action: async (values) => {
 			if (!values) return;
 			try {
-				// Check for duplicate program (prevent same program in multiple rows)
-				if (values.program) {
-					let existing_rows = await frappe.db.get_list("Bulk Fee Invoice Creation Row", {
-						filters: {
-							bulk_fee_invoice_creation: frm.doc.name,
-							program: values.program
-						},
-						fields: ["name", "program"]
-					});
-					
-					// If editing, exclude current row from check
-					if (is_edit && row_name) {
-						existing_rows = existing_rows.filter(r => r.name !== row_name);
-					}
-					
-					// Also filter out rows with empty/null program
-					existing_rows = existing_rows.filter(r => r.program && r.program.trim() !== '');
-					
-					if (existing_rows.length > 0) {
-						frappe.msgprint({
-							title: __("Validation Error"),
-							message: __("This program '{0}' is already selected in another row. Please select a different program.", [values.program]),
-							indicator: "orange",
-						});
-						return;
-					}
-				}
-				
 				// Get data from custom table
 				const sections = get_sections_from_table();
 				
@@ -458,73 +555,22 @@ function open_add_row_dialog(frm, row_name = null) {
 					return;
 				}
 
-				// Format for insert/update
-				const sections_formatted = sections.map((row) => ({
-					doctype: "Bulk Fee Invoice Creation Row Section",
-					section: row.section,
-				}));
-
-				if (is_edit) {
-					// Update existing row
-					await frappe.call({
-						method: "frappe.client.set_value",
-						args: {
-							doctype: "Bulk Fee Invoice Creation Row",
-							name: row_name,
-							fieldname: "program",
-							value: values.program,
-						},
-					});
-					
-					// Delete existing sections
-					const existing_doc = await frappe.db.get_doc("Bulk Fee Invoice Creation Row", row_name);
-					if (existing_doc.sections) {
-						for (const section_row of existing_doc.sections) {
-							await frappe.call({
-								method: "frappe.client.delete",
-								args: {
-									doctype: "Bulk Fee Invoice Creation Row Section",
-									name: section_row.name,
-								},
-							});
-						}
-					}
-					
-					// Add new sections
-					for (const section_row of sections_formatted) {
-						await frappe.call({
-							method: "frappe.client.insert",
-							args: {
-								doc: {
-									...section_row,
-									parent: row_name,
-									parenttype: "Bulk Fee Invoice Creation Row",
-									parentfield: "sections",
-								},
-							},
-						});
-					}
-					
-					d.hide();
-					frappe.msgprint(__("Row updated successfully"));
-				} else {
-					// Create new row
-					await frappe.call({
-						method: "frappe.client.insert",
-						args: {
-							doc: {
-								doctype: "Bulk Fee Invoice Creation Row",
-								bulk_fee_invoice_creation: frm.doc.name,
-								program: values.program,
-								sections: sections_formatted,
-							},
-						},
-						freeze: true,
-						freeze_message: __("Creating Row..."),
-					});
-					d.hide();
-					frappe.msgprint(__("Row created successfully"));
-				}
+				// Create or update the row with all its sections in one request.
+				// The server also rejects a program that is already used in another row.
+				await frappe.call({
+					method: "eduction_override.fees.doctype.bulk_fee_invoice_creation_row.bulk_fee_invoice_creation_row.save_row",
+					args: {
+						bulk_fee_invoice_creation: frm.doc.name,
+						program: values.program,
+						sections: sections.map((row) => row.section),
+						row_name: is_edit ? row_name : null,
+					},
+					freeze: true,
+					freeze_message: is_edit ? __("Updating Row...") : __("Creating Row..."),
+				});
+				
+				d.hide();
+				frappe.msgprint(is_edit ? __("Row updated successfully") : __("Row created successfully"));
 				render_rows_table(frm);
 			} catch (e) {
 				console.error(e);
@@ -869,14 +915,15 @@ async function render_rows_table(frm) {
 		return;
 	}
 
-	// Fetch all Rows for this Bulk Fee Invoice Creation
+	// Fetch all Rows for this Bulk Fee Invoice Creation with their sections,
+	// display names and student counts in a single call
 	let rows_list = [];
 	try {
-		rows_list = await frappe.db.get_list("Bulk Fee Invoice Creation Row", {
-			filters: { bulk_fee_invoice_creation: frm.doc.name },
-			fields: ["name", "program"],
-			order_by: "creation asc",
+		const r = await frappe.call({
+			method: 'eduction_override.fees.doctype.bulk_fee_invoice_creation.bulk_fee_invoice_creation.get_rows_tree',
+			args: { bulk_fee_invoice_creation: frm.doc.name },
 		});
+		rows_list = r.message || [];
 		
 		// Filter out duplicate programs - keep only the first occurrence
 		const seen_programs = new Set();
@@ -910,69 +957,33 @@ async function render_rows_table(frm) {
 			<tbody>`;
 
 	if (rows_list.length > 0) {
-		// Fetch full docs with sections
 		for (let i = 0; i < rows_list.length; i++) {
 			const row = rows_list[i];
-			try {
-				const full_doc = await frappe.db.get_doc("Bulk Fee Invoice Creation Row", row.name);
-				let sections_list = [];
-				let sections_display = [];
-				let row_total_students = 0;
-				
-				if (full_doc.sections) {
-					sections_list = full_doc.sections.map(s => s.section).filter(s => s);
-					// Get section names and student counts for display
-					for (let j = 0; j < sections_list.length; j++) {
-						try {
-							const section_doc = await frappe.db.get_doc("Student Group", sections_list[j]);
-							sections_display.push(section_doc.student_group_name || sections_list[j]);
-							
-							// Count students in this section
-							const student_count = await frappe.db.count("Student Group Student", {
-								filters: {
-									parent: sections_list[j],
-									active: 1
-								}
-							});
-							row_total_students += student_count;
-						} catch(e) {
-							sections_display.push(sections_list[j]);
-						}
-					}
-				}
-				
-				let program_name = full_doc.program || '';
-				// Get program display name
-				if (program_name) {
-					try {
-						const program_doc = await frappe.db.get_doc("Program", program_name);
-						program_name = program_doc.program_name || program_name;
-					} catch(e) {}
-				}
+			const sections_list = row.sections.map(s => s.section);
+			const sections_display = row.sections.map(s => s.student_group_name);
+			const row_total_students = row.total_students;
+			const program_name = row.program_name || '';
 
-				html += `
-				<tr data-row-name="${row.name}">
-					<td class="cs-cell cs-number">${i + 1}</td>
-					<td class="cs-cell cs-class">${frappe.utils.escape_html(program_name || 'Not set')}</td>
-					<td class="cs-cell cs-sections">
-						${sections_display.length > 0 ? frappe.utils.escape_html(sections_display.join(', ')) : '<span class="text-muted">No sections</span>'}
-						${sections_list.length > 0 ? ` <span class="text-muted">(${sections_list.length} section${sections_list.length > 1 ? 's' : ''})</span>` : ''}
-					</td>
-					<td class="cs-cell cs-students">
-						${row_total_students > 0 ? `<span class="text-primary"><strong>${row_total_students}</strong></span>` : '<span class="text-muted">-</span>'}
-					</td>
-					<td class="cs-cell cs-actions">
-						<button type="button" class="btn btn-xs btn-default edit-row-btn" data-row-name="${row.name}" title="${__('Edit')}">
-							<i class="fa fa-edit"></i>
-						</button>
-						<button type="button" class="btn btn-xs btn-danger delete-row-btn" data-row-name="${row.name}" title="${__('Delete')}" style="margin-left: 5px;">
-							<i class="fa fa-trash"></i>
-						</button>
-					</td>
-				</tr>`;
-			} catch(e) {
-				console.error('[Render Rows Table] Error fetching row:', row.name, e);
-			}
+			html += `
+			<tr data-row-name="${row.name}">
+				<td class="cs-cell cs-number">${i + 1}</td>
+				<td class="cs-cell cs-class">${frappe.utils.escape_html(program_name || 'Not set')}</td>
+				<td class="cs-cell cs-sections">
+					${sections_display.length > 0 ? frappe.utils.escape_html(sections_display.join(', ')) : '<span class="text-muted">No sections</span>'}
+					${sections_list.length > 0 ? ` <span class="text-muted">(${sections_list.length} section${sections_list.length > 1 ? 's' : ''})</span>` : ''}
+				</td>
+				<td class="cs-cell cs-students">
+					${row_total_students > 0 ? `<span class="text-primary"><strong>${row_total_students}</strong></span>` : '<span class="text-muted">-</span>'}
+				</td>
+				<td class="cs-cell cs-actions">
+					<button type="button" class="btn btn-xs btn-default edit-row-btn" data-row-name="${row.name}" title="${__('Edit')}">
+						<i class="fa fa-edit"></i>
+					</button>
+					<button type="button" class="btn btn-xs btn-danger delete-row-btn" data-row-name="${row.name}" title="${__('Delete')}" style="margin-left: 5px;">
+						<i class="fa fa-trash"></i>
+					</button>
+				</td>
+			</tr>`;
 		}
 	} else {
 		html += `
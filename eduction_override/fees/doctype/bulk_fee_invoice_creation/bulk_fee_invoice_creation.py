@@ -4,9 +4,19 @@
 import frappe
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import cint
+from frappe.utils import cint, flt, get_datetime, now_datetime, time_diff_in_seconds
 import json
 
+from eduction_override.fees.lookups import RunLookups
+from eduction_override.fees.student_counts import get_active_student_counts
+
+# Runs with more rows than this are created in the background
+BACKGROUND_ROW_THRESHOLD = 10
+
+# Shard jobs time out after 3000 seconds, so a run In Process without any progress
+# for longer than this has lost its workers and can be reset (see reset_stale_run)
+STALE_RUN_TIMEOUT = 3600
+
 
 class BulkFeeInvoiceCreation(Document):
 	def validate(self):
@@ -20,54 +30,44 @@ class BulkFeeInvoiceCreation(Document):
 			self.total_students = 0
 			return
 
-		# Fetch from database using new Bulk Fee Invoice Creation Row structure
-		rows = frappe.get_all(
-			"Bulk Fee Invoice Creation Row",
-			filters={"bulk_fee_invoice_creation": self.name},
-			fields=["name", "program"]
-		)
+		# Fetch rows and their sections from the database in two queries
+		rows = self._get_rows()
+		unique_programs = {row.program for row in rows if row.program}
+		sections = [section for row in rows for section in row.sections]
 
-		unique_programs = set()
-		total_sections = 0
-		total_students = 0
-
-		for row in rows:
-			row_doc = frappe.get_doc("Bulk Fee Invoice Creation Row", row.name)
-			
-			program_name = row_doc.program
-			if program_name:
-				unique_programs.add(program_name)
-			
-			if row_doc.sections:
-				total_sections += len(row_doc.sections)
-				for section_row in row_doc.sections:
-					section_name = section_row.section
-					if section_name:
-						student_count = frappe.db.count(
-							"Student Group Student",
-							filters={"parent": section_name, "active": 1}
-						)
-						total_students += cint(student_count)
+		# Count active students for every section with one grouped query
+		student_counts = get_active_student_counts(sections)
+		total_sections = len(sections)
+		total_students = sum(student_counts.get(section, 0) for section in sections)
 
 		self.total_classes = len(unique_programs)
 		self.total_sections = total_sections
 		self.total_students = total_students
 
 	@frappe.whitelist()
-	def create_fee_schedules(self):
-		"""Create fee schedules for all selected sections."""
+	def create_fee_schedules(self, run_in_background=None):
+		"""Create fee schedules for all selected sections.
+
+		Large runs are split into one shard per program and queued on the long queue,
+		where several workers can process them in parallel (see process_fee_schedule_shard).
+		Pass run_in_background to force either mode.
+		"""
 		if not self.name:
 			frappe.throw(_("Please save the document first."))
 		
+		# Lock the run so that a second click waits for this one and then sees it In Process
+		run = frappe.db.get_value(self.doctype, self.name, ["status", "modified"], as_dict=True, for_update=True)
+		if run.status == "In Process":
+			if not self._is_stale_run(run.modified):
+				frappe.throw(_("Fee Schedules are already being created for {0}").format(self.name))
+			# The workers of the previous run are gone; its Queued rows are processed again
+			self._reset_queued_rows()
+
 		# Reload to ensure fee_components are loaded
 		self.reload()
 
-		# Fetch from database - using new Bulk Fee Invoice Creation Row structure
-		rows = frappe.get_all(
-			"Bulk Fee Invoice Creation Row",
-			filters={"bulk_fee_invoice_creation": self.name},
-			fields=["name", "program"]
-		)
+		# Fetch rows with their sections once - using new Bulk Fee Invoice Creation Row structure
+		rows = self._get_rows()
 
 		if not rows:
 			frappe.throw(_("Please add at least one program with sections."))
@@ -75,99 +75,403 @@ class BulkFeeInvoiceCreation(Document):
 		if not self.fee_structure:
 			frappe.throw(_("Please select Fee Structure"))
 
+		if run_in_background is None:
+			run_in_background = len(rows) > BACKGROUND_ROW_THRESHOLD
+
+		if cint(run_in_background):
+			return self._enqueue_fee_schedule_shards(rows)
+
 		self.db_set("status", "In Process")
-		created_schedules = []
-		errors = []
+		context = self._get_schedule_context(rows)
+		created_schedules, errors = self._create_fee_schedules_for_rows(rows, context)
+
+		# Reload to get fresh data including fee_components
+		self.reload()
+		
+		if errors:
+			self.error_log = "\n".join(errors)
+			self.status = "Failed"
+			frappe.msgprint(
+				_("Some fee schedules could not be created. Please check Error Log."),
+				alert=True
+			)
+		else:
+			self.error_log = None
+			self.status = "Completed"
+			frappe.msgprint(
+				_("Successfully created {0} fee schedule(s)").format(len(created_schedules)),
+				indicator="green"
+			)
+
+		self.save()
+		return {
+			"created": len(created_schedules),
+			"errors": len(errors),
+			"schedules": [s["fee_schedule"] for s in created_schedules]
+		}
+
+	@frappe.whitelist()
+	def reset_stale_run(self):
+		"""Mark a run whose background workers died as Failed, so it can be run again.
 
-		fee_structure_doc = frappe.get_doc("Fee Structure", self.fee_structure)
-		academic_year = None
-		academic_term = None
-		student_category = fee_structure_doc.student_category
+		A run counts as stale once nothing has been checkpointed for STALE_RUN_TIMEOUT
+		seconds. Its Queued rows are moved back to Pending; Completed rows are kept.
+		"""
+		self.check_permission("write")
+
+		run = frappe.db.get_value(self.doctype, self.name, ["status", "modified"], as_dict=True, for_update=True)
+		if run.status != "In Process":
+			frappe.throw(_("{0} is not In Process").format(self.name))
+		if not self._is_stale_run(run.modified):
+			frappe.throw(
+				_("Fee Schedules of {0} are still being created. A run can be reset after {1} minutes without progress.").format(
+					self.name, STALE_RUN_TIMEOUT // 60
+				)
+			)
+
+		rows = self._reset_queued_rows()
+		self.db_set({
+			"status": "Failed",
+			"error_log": _("The run was reset after its background jobs stopped; {0} row(s) were not processed.").format(rows),
+		})
+		return rows
+
+	def _is_stale_run(self, modified):
+		"""Whether a run In Process has had no progress (run or checkpoint change) for STALE_RUN_TIMEOUT seconds."""
+		last_checkpoint = frappe.db.sql("""
+			SELECT MAX(modified)
+			FROM `tabBulk Fee Invoice Creation Fee Schedule`
+			WHERE parent = %s AND parenttype = %s AND parentfield = 'fee_schedules'
+		""", (self.name, self.doctype))[0][0]
+
+		last_activity = max(get_datetime(d) for d in (modified, last_checkpoint) if d)
+		return time_diff_in_seconds(now_datetime(), last_activity) > STALE_RUN_TIMEOUT
+
+	def _reset_queued_rows(self):
+		"""Move the Queued checkpoints of this run back to Pending and return how many there were."""
+		queued = frappe.get_all(
+			"Bulk Fee Invoice Creation Fee Schedule",
+			filters={"parent": self.name, "parenttype": self.doctype, "parentfield": "fee_schedules", "status": "Queued"},
+			pluck="name",
+		)
+		for name in queued:
+			frappe.db.set_value("Bulk Fee Invoice Creation Fee Schedule", name, "status", "Pending")
+		return len(queued)
+
+	@frappe.whitelist()
+	def create_consolidated_invoices(self):
+		"""Queue one invoice per student for all Fee Schedules of this run (see consolidated_invoices)."""
+		if not self.consolidate_invoices:
+			frappe.throw(_("One Invoice per Student is not enabled for {0}").format(self.name))
+		if self.status != "Completed":
+			frappe.throw(_("Please create the Fee Schedules first."))
+		frappe.has_permission("Sales Invoice", "create", throw=True)
+
+		from eduction_override.fees.consolidated_invoices import validate_run_schedules
+
+		# Checked again under a lock by the job, but refuse right away when possible
+		validate_run_schedules(self.name)
+
+		frappe.enqueue(
+			"eduction_override.fees.consolidated_invoices.generate_consolidated_invoices",
+			queue="long",
+			timeout=3000,
+			enqueue_after_commit=True,
+			bulk_fee_invoice_creation=self.name,
+			user=frappe.session.user,
+		)
+
+	@frappe.whitelist()
+	def get_plan(self):
+		"""Project what create_fee_schedules would produce, without writing anything.
+
+		Returns the number of Fee Schedules and invoices and the expected grand total,
+		overall and per program, computed with aggregate queries over the configured
+		rows, sections, fee components and active students. Rows that already have a
+		Completed checkpoint are listed but not counted, as a re-run skips them.
+		"""
+		if not self.name:
+			frappe.throw(_("Please save the document first."))
+
+		amount_per_student = self._get_amount_per_student()
+
+		rows = frappe.db.sql("""
+			SELECT
+				r.name AS row_name,
+				r.program,
+				p.program_name,
+				COUNT(DISTINCT rs.name) AS sections,
+				COUNT(sgs.name) AS students,
+				MAX(cp.status) AS status
+			FROM `tabBulk Fee Invoice Creation Row` r
+			INNER JOIN `tabBulk Fee Invoice Creation Row Section` rs
+				ON rs.parent = r.name
+				AND rs.parenttype = 'Bulk Fee Invoice Creation Row'
+				AND IFNULL(rs.section, '') != ''
+			LEFT JOIN `tabStudent Group Student` sgs
+				ON sgs.parent = rs.section AND sgs.active = 1
+			LEFT JOIN `tabProgram` p ON p.name = r.program
+			LEFT JOIN `tabBulk Fee Invoice Creation Fee Schedule` cp
+				ON cp.parent = r.bulk_fee_invoice_creation
+				AND cp.parenttype = 'Bulk Fee Invoice Creation'
+				AND cp.row = r.name
+			WHERE r.bulk_fee_invoice_creation = %(name)s
+			GROUP BY r.name, r.program, p.program_name
+			ORDER BY MIN(r.creation)
+		""", {"name": self.name}, as_dict=True)
+
+		programs = []
+		plan = frappe._dict(fee_schedules=0, invoices=0, grand_total=0, amount_per_student=amount_per_student)
+		for row in rows:
+			pending = row.status != "Completed"
+			grand_total = flt(row.students * amount_per_student)
+			programs.append({
+				"row": row.row_name,
+				"program": row.program,
+				"program_name": row.program_name or row.program,
+				"sections": row.sections,
+				"students": row.students,
+				"grand_total": grand_total,
+				"status": row.status or "Pending",
+			})
+			if pending:
+				plan.fee_schedules += 1
+				plan.invoices += row.students
+				plan.grand_total += grand_total
+
+		plan.programs = programs
+		plan.currency = self.company and frappe.get_cached_value("Company", self.company, "default_currency")
+		return plan
+
+	def _get_amount_per_student(self):
+		"""Return the per-student total of the fee components a new schedule would get.
+
+		Components of this document take priority over the Fee Structure's, as in
+		_create_fee_schedule_for_row.
+		"""
+		totals = dict(frappe.db.sql("""
+			SELECT parenttype, SUM(IF(IFNULL(total, 0) != 0, total, IFNULL(amount, 0)))
+			FROM `tabFee Component`
+			WHERE (parenttype = 'Bulk Fee Invoice Creation' AND parent = %(name)s AND parentfield = 'fee_components')
+				OR (parenttype = 'Fee Structure' AND parent = %(fee_structure)s AND parentfield = 'components')
+			GROUP BY parenttype
+		""", {"name": self.name, "fee_structure": self.fee_structure}))
+
+		if totals.get("Bulk Fee Invoice Creation") is not None:
+			return flt(totals["Bulk Fee Invoice Creation"])
+		return flt(totals.get("Fee Structure"))
+
+	def _enqueue_fee_schedule_shards(self, rows):
+		"""Queue one job per program shard; the jobs run in parallel on the long queue.
+
+		Every row still to be processed gets a Queued checkpoint first. Shards flip
+		their rows to Completed or Failed, and the run is finalized by whichever shard
+		leaves no Queued row behind (see finalize_background_run).
+		"""
+		context = self._get_schedule_context(rows)
+		checkpoints = self._get_row_checkpoints()
+
+		shards = {}
+		for row in rows:
+			checkpoint = checkpoints.get(row.name)
+			if not row.sections or (checkpoint and checkpoint.status == "Completed"):
+				continue
+			self._set_row_checkpoint(checkpoints, row.name, "Queued")
+			shards.setdefault(row.program or row.name, []).append(row.name)
+
+		self.db_set({"status": "In Process", "error_log": None})
+		for row_names in shards.values():
+			frappe.enqueue(
+				process_fee_schedule_shard,
+				queue="long",
+				timeout=3000,
+				enqueue_after_commit=True,
+				bulk_fee_invoice_creation=self.name,
+				row_names=row_names,
+				academic_year=context.academic_year,
+				academic_term=context.academic_term,
+				user=frappe.session.user,
+			)
+
+		if not shards:
+			finalize_background_run(self.name, frappe.session.user)
+
+		frappe.msgprint(
+			_("Fee Schedules will be created in the background. The status will be updated once all rows are processed."),
+			alert=True
+		)
+		return {"queued": True, "rows": sum(len(d) for d in shards.values()), "shards": len(shards)}
+
+	def _get_rows(self, row_names=None):
+		"""Return the rows of this run with their section names, using two queries.
+
+		Each row is a dict with name, program and sections (list of Student Group names).
+		"""
+		filters = {"bulk_fee_invoice_creation": self.name}
+		if row_names is not None:
+			filters["name"] = ["in", row_names]
+
+		rows = frappe.get_all(
+			"Bulk Fee Invoice Creation Row",
+			filters=filters,
+			fields=["name", "program"],
+			order_by="creation asc"
+		)
+		if not rows:
+			return []
+
+		sections_by_row = {}
+		for d in frappe.get_all(
+			"Bulk Fee Invoice Creation Row Section",
+			filters={
+				"parent": ["in", [row.name for row in rows]],
+				"parenttype": "Bulk Fee Invoice Creation Row",
+			},
+			fields=["parent", "section"],
+			order_by="idx asc"
+		):
+			if d.section:
+				sections_by_row.setdefault(d.parent, []).append(d.section)
+
+		for row in rows:
+			row.sections = sections_by_row.get(row.name, [])
+
+		return rows
+
+	def _get_schedule_context(self, rows, lookups=None):
+		"""Return the fee structure and the academic year/term shared by every schedule of this run."""
+		lookups = lookups or RunLookups()
+		fee_structure_doc = lookups.get_doc("Fee Structure", self.fee_structure)
+		context = frappe._dict(
+			lookups=lookups,
+			fee_structure_doc=fee_structure_doc,
+			academic_year=None,
+			academic_term=None,
+			student_category=fee_structure_doc.student_category,
+		)
 
 		# Get academic year and term from first section if available
 		for row in rows:
-			row_doc = frappe.get_doc("Bulk Fee Invoice Creation Row", row.name)
-			if row_doc.sections and len(row_doc.sections) > 0:
-				first_section = row_doc.sections[0].section
-				if first_section:
-					section_doc = frappe.get_doc("Student Group", first_section)
-					academic_year = section_doc.academic_year
-					academic_term = section_doc.academic_term
-					break
+			if row.sections:
+				section_doc = lookups.get_doc("Student Group", row.sections[0])
+				context.academic_year = section_doc.academic_year
+				context.academic_term = section_doc.academic_term
+				break
+
+		return context
+
+	def _create_fee_schedules_for_rows(self, rows, context, lock_rows=False):
+		"""Create one fee schedule per row and return (created_schedules, errors).
+
+		Every row's outcome is checkpointed in the fee_schedules table. Rows that already
+		have a Completed checkpoint are skipped, so re-running a failed run only retries
+		the rows that failed. With lock_rows, each row is locked (SELECT ... FOR UPDATE)
+		and its checkpoint re-read before processing, so two workers never take the same row.
+		"""
+		created_schedules = []
+		errors = []
+		checkpoints = self._get_row_checkpoints()
 
 		# Process each row - create ONE fee schedule per row with ALL sections attached
 		for row in rows:
-			row_doc = frappe.get_doc("Bulk Fee Invoice Creation Row", row.name)
-			
-			if not row_doc.sections:
+			row_name = row.name
+			checkpoint = checkpoints.get(row_name)
+			if lock_rows:
+				frappe.db.get_value("Bulk Fee Invoice Creation Row", row_name, "name", for_update=True)
+				if checkpoint:
+					# A locking read sees the latest committed status, not the snapshot
+					# taken when this transaction started
+					checkpoint.status = frappe.db.get_value(
+						"Bulk Fee Invoice Creation Fee Schedule", checkpoint.name, "status", for_update=True
+					)
+			if checkpoint and checkpoint.status == "Completed":
 				continue
 
-			# Collect all sections from this row
-			section_names = []
-			for section_row in row_doc.sections:
-				section_name = section_row.section
-				if section_name:
-					section_names.append(section_name)
-
+			# All sections from this row
+			section_names = row.sections
 			if not section_names:
 				continue
 
+			# Roll back only this row's writes if it fails
+			frappe.db.savepoint("bulk_fee_schedule_row")
 			try:
 				# Create ONE fee schedule for this row with ALL sections
 				# Pass self to access fee_components from bulk creation
 				fee_schedule = self._create_fee_schedule_for_row(
-					row_doc,
+					row,
 					section_names,
-					fee_structure_doc,
-					academic_year,
-					academic_term,
-					student_category,
-					self
+					context.fee_structure_doc,
+					context.academic_year,
+					context.academic_term,
+					context.student_category,
+					self,
+					lookups=context.lookups
 				)
 				
 				created_schedules.append({
 					"fee_schedule": fee_schedule.name,
-					"row_name": row.name,
+					"row_name": row_name,
 					"status": fee_schedule.status
 				})
+				self._set_row_checkpoint(checkpoints, row_name, "Completed", fee_schedule=fee_schedule.name)
 
 			except Exception as e:
-				error_msg = f"Error creating fee schedule for row {row.name}: {str(e)}"
+				frappe.db.rollback(save_point="bulk_fee_schedule_row")
+				error_msg = f"Error creating fee schedule for row {row_name}: {str(e)}"
 				errors.append(error_msg)
 				frappe.log_error(
 					title=f"Bulk Fee Invoice Creation Error",
 					message=error_msg
 				)
+				self._set_row_checkpoint(checkpoints, row_name, "Failed", error=str(e))
 
-		# Reload to get fresh data including fee_components
-		self.reload()
-		
-		if errors:
-			self.error_log = "\n".join(errors)
-			self.status = "Failed"
-			frappe.msgprint(
-				_("Some fee schedules could not be created. Please check Error Log."),
-				alert=True
-			)
-		else:
-			self.error_log = None
-			self.status = "Completed"
-			frappe.msgprint(
-				_("Successfully created {0} fee schedule(s)").format(len(created_schedules)),
-				indicator="green"
+		return created_schedules, errors
+
+	def _get_row_checkpoints(self):
+		"""Return the stored per-row results of previous runs, keyed by row name."""
+		checkpoints = frappe.get_all(
+			"Bulk Fee Invoice Creation Fee Schedule",
+			filters={"parent": self.name, "parenttype": self.doctype, "parentfield": "fee_schedules"},
+			fields=["name", "row", "status", "idx"],
+			order_by="idx asc"
+		)
+		return {d.row: d for d in checkpoints if d.row}
+
+	def _set_row_checkpoint(self, checkpoints, row_name, status, fee_schedule=None, error=None):
+		"""Insert or update the fee_schedules entry holding the result of a row.
+
+		The entry's modified time tracks the run's progress (see _is_stale_run).
+		"""
+		checkpoint = checkpoints.get(row_name)
+		if checkpoint:
+			frappe.db.set_value(
+				"Bulk Fee Invoice Creation Fee Schedule",
+				checkpoint.name,
+				{"status": status, "fee_schedule": fee_schedule, "error": error},
 			)
+			checkpoint.status = status
+			return
 
-		self.save()
-		return {
-			"created": len(created_schedules),
-			"errors": len(errors),
-			"schedules": [s["fee_schedule"] for s in created_schedules]
-		}
+		entry = frappe.get_doc({
+			"doctype": "Bulk Fee Invoice Creation Fee Schedule",
+			"parent": self.name,
+			"parenttype": self.doctype,
+			"parentfield": "fee_schedules",
+			"idx": max([d.idx for d in checkpoints.values()] or [0]) + 1,
+			"row": row_name,
+			"fee_schedule": fee_schedule,
+			"status": status,
+			"error": error,
+		})
+		entry.db_insert()
+		checkpoints[row_name] = frappe._dict(name=entry.name, row=row_name, status=status, idx=entry.idx)
 
-	def _create_fee_schedule_for_row(self, row_doc, section_names, fee_structure_doc, academic_year, academic_term, student_category, bulk_doc=None):
+	def _create_fee_schedule_for_row(self, row_doc, section_names, fee_structure_doc, academic_year, academic_term, student_category, bulk_doc=None, lookups=None):
 		"""Create a single fee schedule for a row with all sections attached."""
+		lookups = lookups or RunLookups()
+
 		# Get section details from first section for defaults
-		first_section_doc = frappe.get_doc("Student Group", section_names[0])
+		first_section_doc = lookups.get_doc("Student Group", section_names[0])
 		
 		# Get currency from company if not in fee structure
 		currency = None
@@ -175,11 +479,10 @@ class BulkFeeInvoiceCreation(Document):
 			currency = fee_structure_doc.currency
 		else:
 			# Get currency from company
-			import erpnext
 			if self.company:
-				currency = erpnext.get_company_currency(self.company)
+				currency = lookups.get_company_currency(self.company)
 			else:
-				currency = frappe.db.get_single_value("System Settings", "default_currency") or "USD"
+				currency = lookups.get_default_currency()
 		
 		# Get account and receivable_account safely - check if attributes exist
 		account = None
@@ -249,18 +552,12 @@ class BulkFeeInvoiceCreation(Document):
 		})
 
 		# Add ALL sections from this row to the fee schedule with student counts
-		# Use simple count like in bulk creation - count active students in Student Group Student table
+		# Counted the same way as calculate_summary, with one query for the whole row
+		student_counts = get_active_student_counts(section_names)
 		for section_name in section_names:
-			# Calculate total students for this section - simple count of active students
-			# This matches the method used in bulk creation calculate_summary
-			student_count = frappe.db.count(
-				"Student Group Student",
-				filters={"parent": section_name, "active": 1}
-			)
-			
 			fee_schedule.append("student_groups", {
 				"student_group": section_name,
-				"total_students": cint(student_count) or 0
+				"total_students": student_counts.get(section_name, 0)
 			})
 
 		# Add fee components from bulk creation document (priority) or fee structure (fallback)
@@ -268,17 +565,9 @@ class BulkFeeInvoiceCreation(Document):
 		if bulk_doc and hasattr(bulk_doc, 'fee_components') and bulk_doc.fee_components:
 			# Use components from bulk creation document
 			components_to_use = bulk_doc.fee_components
-			frappe.log_error(
-				title="Fee Components Debug",
-				message=f"Using {len(components_to_use)} components from bulk creation"
-			)
 		elif fee_structure_doc and hasattr(fee_structure_doc, 'components') and fee_structure_doc.components:
 			# Fall back to fee structure components
 			components_to_use = fee_structure_doc.components
-			frappe.log_error(
-				title="Fee Components Debug",
-				message=f"Using {len(components_to_use)} components from fee structure (fallback)"
-			)
 		
 		# Add all components to fee schedule
 		for component in components_to_use:
@@ -291,20 +580,159 @@ class BulkFeeInvoiceCreation(Document):
 				"total": component.total or component.amount or 0,
 			})
 
+		# Compute the totals up front so the schedule is written once, fully calculated
+		fee_schedule.total_amount = sum(flt(d.total) for d in fee_schedule.components)
+		fee_schedule.grand_total = sum(cint(d.total_students) for d in fee_schedule.student_groups) * fee_schedule.total_amount
+
+		# Let CustomFeeSchedule.calculate_total_and_program reuse the counts instead of recounting
+		fee_schedule.flags.student_counts = student_counts
 		fee_schedule.insert()
 		
-		# After insert, the validate method may have recalculated total_students
-		# Re-set the student counts to ensure they match the bulk creation values
-		fee_schedule.reload()
-		for student_group_row in fee_schedule.student_groups:
-			# Recalculate using simple count (same as bulk creation)
-			student_count = frappe.db.count(
-				"Student Group Student",
-				filters={"parent": student_group_row.student_group, "active": 1}
-			)
-			student_group_row.total_students = cint(student_count) or 0
-		
-		# Save again to persist the student counts
-		fee_schedule.save()
-		
 		return fee_schedule
+
+
+
+@frappe.whitelist()
+def get_rows_tree(bulk_fee_invoice_creation):
+	"""Return every row of a Bulk Fee Invoice Creation with its sections for the form.
+
+	Display names and active-student counts are resolved with set-based queries,
+	so the whole tree is built with a fixed number of queries regardless of its size.
+	"""
+	doc = frappe.get_doc("Bulk Fee Invoice Creation", bulk_fee_invoice_creation)
+	doc.check_permission("read")
+
+	rows = doc._get_rows()
+	programs = {row.program for row in rows if row.program}
+	sections = {section for row in rows for section in row.sections}
+
+	program_names = dict(
+		frappe.get_all(
+			"Program",
+			filters={"name": ["in", list(programs)]},
+			fields=["name", "program_name"],
+			as_list=True
+		)
+	) if programs else {}
+	section_names = dict(
+		frappe.get_all(
+			"Student Group",
+			filters={"name": ["in", list(sections)]},
+			fields=["name", "student_group_name"],
+			as_list=True
+		)
+	) if sections else {}
+	student_counts = get_active_student_counts(sections)
+
+	tree = []
+	for row in rows:
+		row_sections = [
+			{
+				"section": section,
+				"student_group_name": section_names.get(section) or section,
+				"total_students": student_counts.get(section, 0),
+			}
+			for section in row.sections
+		]
+		tree.append({
+			"name": row.name,
+			"program": row.program,
+			"program_name": program_names.get(row.program) or row.program,
+			"sections": row_sections,
+			"total_students": sum(d["total_students"] for d in row_sections),
+		})
+
+	return tree
+
+def process_fee_schedule_shard(
+	bulk_fee_invoice_creation, row_names, academic_year=None, academic_term=None, user=None
+):
+	"""Create the fee schedules for one shard of rows (one program) and commit.
+
+	Shards of the same run are processed in parallel by different workers. The status
+	of the Bulk Fee Invoice Creation is only set to Completed or Failed once no row of
+	the run is left Queued.
+	"""
+	try:
+		doc = frappe.get_doc("Bulk Fee Invoice Creation", bulk_fee_invoice_creation)
+		lookups = RunLookups()
+		fee_structure_doc = lookups.get_doc("Fee Structure", doc.fee_structure)
+		context = frappe._dict(
+			lookups=lookups,
+			fee_structure_doc=fee_structure_doc,
+			academic_year=academic_year,
+			academic_term=academic_term,
+			student_category=fee_structure_doc.student_category,
+		)
+
+		rows = doc._get_rows(row_names)
+		doc._create_fee_schedules_for_rows(rows, context, lock_rows=True)
+		frappe.db.commit()
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(title="Bulk Fee Invoice Creation Error")
+		# Don't leave the shard's rows Queued, or the run would never be finalized
+		frappe.db.set_value(
+			"Bulk Fee Invoice Creation Fee Schedule",
+			{
+				"parent": bulk_fee_invoice_creation,
+				"parenttype": "Bulk Fee Invoice Creation",
+				"row": ["in", row_names],
+				"status": "Queued",
+			},
+			{"status": "Failed", "error": str(e)},
+			update_modified=False
+		)
+		frappe.db.commit()
+
+	finalize_background_run(bulk_fee_invoice_creation, user)
+
+
+def finalize_background_run(bulk_fee_invoice_creation, user=None):
+	"""Merge the row checkpoints into the parent once every shard has finished.
+
+	The parent is locked while checking, so exactly one shard sets the final status.
+	"""
+	status = frappe.db.get_value(
+		"Bulk Fee Invoice Creation", bulk_fee_invoice_creation, "status", for_update=True
+	)
+	if status != "In Process":
+		frappe.db.commit()
+		return
+
+	checkpoints = frappe.get_all(
+		"Bulk Fee Invoice Creation Fee Schedule",
+		filters={
+			"parent": bulk_fee_invoice_creation,
+			"parenttype": "Bulk Fee Invoice Creation",
+			"parentfield": "fee_schedules",
+		},
+		fields=["row", "status", "error"],
+	)
+	queued = [d for d in checkpoints if d.status == "Queued"]
+	if queued:
+		frappe.db.commit()
+		publish_progress(
+			bulk_fee_invoice_creation, (len(checkpoints) - len(queued)) * 100 / len(checkpoints), user
+		)
+		return
+
+	errors = [
+		f"Error creating fee schedule for row {d.row}: {d.error}" for d in checkpoints if d.status == "Failed"
+	]
+	frappe.db.set_value(
+		"Bulk Fee Invoice Creation",
+		bulk_fee_invoice_creation,
+		{"status": "Failed" if errors else "Completed", "error_log": "\n".join(errors) or None},
+	)
+	frappe.db.commit()
+	publish_progress(bulk_fee_invoice_creation, 100, user, reload=True)
+
+
+def publish_progress(bulk_fee_invoice_creation, progress, user=None, reload=False):
+	"""Publish the progress of a background run to the Bulk Fee Invoice Creation form."""
+	frappe.publish_realtime(
+		"bulk_fee_invoice_creation_progress",
+		{"name": bulk_fee_invoice_creation, "progress": cint(progress), "reload": cint(reload)},
+		user=user,
+	)
@@ -45,6 +45,35 @@ class TestBulkFeeInvoiceCreation(FrappeTestCase):
 		self.assertGreater(len(student_groups), 0, "Should have at least one student group")
 		self.assertEqual(student_groups[0].get("program"), program, "Student group should belong to the program")
 	
+	def test_active_student_counts(self):
+		"""Test that active students are counted for several groups in one call"""
+		from eduction_override.fees.student_counts import get_active_student_counts
+
+		groups = [f"Test Student Group {i+1}" for i in range(3)]
+		counts = get_active_student_counts(groups + [None, groups[0]])
+
+		self.assertEqual(set(counts), set(groups), "Should return one entry per distinct group")
+		for group in groups:
+			expected = frappe.db.count("Student Group Student", filters={"parent": group, "active": 1})
+			self.assertEqual(counts[group], expected, "Count should match active Student Group Students")
+
+		self.assertEqual(get_active_student_counts([]), {}, "No groups should return an empty dict")
+
+	def test_student_group_summary_cache(self):
+		"""Test that a Student Group's cached summary is dropped once its change is committed"""
+		from eduction_override.fees.student_counts import STUDENT_GROUP_SUMMARY_CACHE, get_student_group_summaries
+
+		group = "Test Student Group 1"
+		get_student_group_summaries([group])
+		self.assertIsNotNone(frappe.cache().hget(STUDENT_GROUP_SUMMARY_CACHE, group), "Summary should be cached")
+		self.assertGreater(frappe.cache().ttl(frappe.cache().make_key(STUDENT_GROUP_SUMMARY_CACHE)), 0, "Cache should expire")
+
+		frappe.get_doc("Student Group", group).save()
+		self.assertIsNotNone(frappe.cache().hget(STUDENT_GROUP_SUMMARY_CACHE, group), "Summary should stay until the commit")
+
+		frappe.db.commit()
+		self.assertIsNone(frappe.cache().hget(STUDENT_GROUP_SUMMARY_CACHE, group), "Summary should be dropped")
+
 	def test_bulk_fee_invoice_creation(self):
 		"""Test creating a Bulk Fee Invoice Creation document"""
 		# Create the document
@@ -66,6 +95,44 @@ class TestBulkFeeInvoiceCreation(FrappeTestCase):
 			if doc.name:
 				frappe.delete_doc("Bulk Fee Invoice Creation", doc.name, force=1)
 	
+	def test_reset_stale_run(self):
+		"""Test that a run whose background jobs stopped can be reset, but a running one can't"""
+		from eduction_override.fees.doctype.bulk_fee_invoice_creation.bulk_fee_invoice_creation import (
+			STALE_RUN_TIMEOUT,
+		)
+
+		doc = frappe.get_doc({
+			"doctype": "Bulk Fee Invoice Creation",
+			"fee_structure": frappe.db.get_value("Fee Structure", {}, "name"),
+			"posting_date": frappe.utils.today(),
+			"due_date": frappe.utils.add_days(frappe.utils.today(), 30),
+			"company": frappe.db.get_value("Company", {}, "name")
+		})
+		doc.insert()
+		
+		try:
+			checkpoints = {}
+			doc._set_row_checkpoint(checkpoints, "Test Row", "Queued")
+			doc.db_set("status", "In Process")
+			self.assertRaises(frappe.ValidationError, doc.reset_stale_run)
+			
+			# No progress for longer than the timeout, as if the shard's worker was killed
+			stale = frappe.utils.add_to_date(frappe.utils.now_datetime(), seconds=-STALE_RUN_TIMEOUT - 60)
+			frappe.db.set_value(doc.doctype, doc.name, "modified", stale, update_modified=False)
+			frappe.db.set_value(
+				"Bulk Fee Invoice Creation Fee Schedule", checkpoints["Test Row"].name, "modified", stale, update_modified=False
+			)
+			
+			self.assertEqual(doc.reset_stale_run(), 1, "The Queued row should be reset")
+			self.assertEqual(frappe.db.get_value(doc.doctype, doc.name, "status"), "Failed", "Run should be Failed")
+			self.assertEqual(
+				frappe.db.get_value("Bulk Fee Invoice Creation Fee Schedule", checkpoints["Test Row"].name, "status"),
+				"Pending",
+				"Queued row should be Pending again"
+			)
+		finally:
+			frappe.delete_doc("Bulk Fee Invoice Creation", doc.name, force=1)
+	
 	def test_class_section_creation(self):
 		"""Test creating a class section with program and student groups"""
 		# Create bulk fee invoice creation first
@@ -89,7 +156,7 @@ class TestBulkFeeInvoiceCreation(FrappeTestCase):
 			class_section.insert()
 			
 			self.assertIsNotNone(class_section.name, "Class section should be saved")
-			self.assertEqual(class_section.class, "Test Program", "Program should be set correctly")
+			self.assertEqual(class_section.get("class"), "Test Program", "Program should be set correctly")
 			
 			import json
 			sections = json.loads(class_section.sections_json)
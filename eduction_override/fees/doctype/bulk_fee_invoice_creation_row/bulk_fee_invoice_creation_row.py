@@ -2,8 +2,12 @@
 # For license information, please see license.txt
 
 from frappe.model.document import Document
+from frappe import _
+from frappe.utils import now
 import frappe
 
+from eduction_override.fees.student_counts import get_active_student_counts
+
 
 class BulkFeeInvoiceCreationRow(Document):
 	def validate(self):
@@ -12,3 +16,78 @@ class BulkFeeInvoiceCreationRow(Document):
 		if not self.sections or len(self.sections) == 0:
 			frappe.throw("Please add at least one Section")
 
+
+@frappe.whitelist()
+def save_row(bulk_fee_invoice_creation, program, sections, row_name=None):
+	"""Create a row, or replace an existing row's program and sections, in one request.
+
+	The whole change runs in the request's transaction, so a failure leaves the row
+	untouched. When editing, the old sections are deleted and the new ones written
+	with a single multi-row insert.
+	"""
+	sections = frappe.parse_json(sections) if isinstance(sections, str) else sections
+	# Drop empty and repeated sections, keeping their order
+	sections = list(dict.fromkeys(section for section in sections or [] if section))
+
+	if not program:
+		frappe.throw(_("Program is required"))
+	if not sections:
+		frappe.throw(_("Please add at least one Section"))
+
+	duplicate_filters = {"bulk_fee_invoice_creation": bulk_fee_invoice_creation, "program": program}
+	if row_name:
+		duplicate_filters["name"] = ["!=", row_name]
+	if frappe.db.exists("Bulk Fee Invoice Creation Row", duplicate_filters):
+		frappe.throw(
+			_("This program '{0}' is already selected in another row. Please select a different program.").format(program)
+		)
+
+	existing_sections = frappe.get_all("Student Group", filters={"name": ["in", sections]}, pluck="name")
+	missing_sections = [section for section in sections if section not in existing_sections]
+	if missing_sections:
+		frappe.throw(_("Student Group {0} does not exist").format(", ".join(missing_sections)))
+
+	student_counts = get_active_student_counts(sections)
+
+	if not row_name:
+		row = frappe.get_doc({
+			"doctype": "Bulk Fee Invoice Creation Row",
+			"bulk_fee_invoice_creation": bulk_fee_invoice_creation,
+			"program": program,
+			"sections": [
+				{"section": section, "total_students": student_counts.get(section, 0)}
+				for section in sections
+			],
+		}).insert()
+		return row.name
+
+	row = frappe.get_doc("Bulk Fee Invoice Creation Row", row_name)
+	row.check_permission("write")
+	if row.bulk_fee_invoice_creation != bulk_fee_invoice_creation:
+		frappe.throw(_("Row {0} does not belong to {1}").format(row_name, bulk_fee_invoice_creation))
+
+	# Replace the section rows in bulk instead of one delete/insert per section
+	frappe.db.delete(
+		"Bulk Fee Invoice Creation Row Section",
+		{"parent": row.name, "parenttype": row.doctype, "parentfield": "sections"}
+	)
+
+	timestamp = now()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		"Bulk Fee Invoice Creation Row Section",
+		fields=[
+			"name", "creation", "modified", "owner", "modified_by", "docstatus",
+			"parent", "parenttype", "parentfield", "idx", "section", "total_students",
+		],
+		values=[
+			(
+				frappe.generate_hash(length=10), timestamp, timestamp, user, user, 0,
+				row.name, row.doctype, "sections", idx, section, student_counts.get(section, 0),
+			)
+			for idx, section in enumerate(sections, start=1)
+		],
+	)
+
+	row.db_set("program", program)
+	return row.name
@@ -0,0 +1,169 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cstr, now
+
+# Attempts per student in one retry run, and the delay before the second attempt
+# (doubled for every further attempt). Only lock and deadlock errors are retried.
+MAX_RETRY_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 1
+
+
+class FeeInvoiceFailure(Document):
+	pass
+
+
+def record_invoice_failures(fee_schedule, failures):
+	"""Add failures (frappe._dicts of student, error and error_class) to the ledger.
+
+	A student has one Fee Invoice Failure per Fee Schedule; failing again reopens
+	it and increments its attempts.
+	"""
+	if not failures:
+		return
+
+	existing = dict(
+		frappe.get_all(
+			"Fee Invoice Failure",
+			filters={"fee_schedule": fee_schedule, "student": ["in", [d.student for d in failures]]},
+			fields=["student", "name"],
+			as_list=True,
+		)
+	)
+	timestamp = now()
+	for failure in failures:
+		if failure.student in existing:
+			frappe.db.sql(
+				"""
+				UPDATE `tabFee Invoice Failure`
+				SET status = 'Open', attempts = attempts + 1, last_attempt = %(timestamp)s,
+					error_class = %(error_class)s, error = %(error)s, modified = %(timestamp)s
+				WHERE name = %(name)s
+			""",
+				{
+					"name": existing[failure.student],
+					"timestamp": timestamp,
+					"error_class": failure.error_class,
+					"error": failure.error,
+				},
+			)
+		else:
+			frappe.get_doc(
+				{
+					"doctype": "Fee Invoice Failure",
+					"fee_schedule": fee_schedule,
+					"student": failure.student,
+					"status": "Open",
+					"attempts": 1,
+					"last_attempt": timestamp,
+					"error_class": failure.error_class,
+					"error": failure.error,
+				}
+			).insert(ignore_permissions=True)
+
+
+def is_transient_error(e):
+	"""Whether e is a lock wait timeout or deadlock that is worth retrying."""
+	return (
+		isinstance(e, frappe.QueryDeadlockError | frappe.QueryTimeoutError)
+		or frappe.db.is_deadlocked(e)
+		or frappe.db.is_timedout(e)
+	)
+
+
+@frappe.whitelist()
+def retry_failed_invoices(fee_schedule):
+	"""Create the invoices of a Fee Schedule's open failures again, in the background."""
+	frappe.has_permission("Sales Invoice", "create", throw=True)
+
+	if not frappe.db.exists("Fee Invoice Failure", {"fee_schedule": fee_schedule, "status": "Open"}):
+		frappe.throw(_("There are no open invoice failures for {0}").format(fee_schedule))
+
+	frappe.enqueue(
+		"eduction_override.fees.doctype.fee_invoice_failure.fee_invoice_failure.process_invoice_retries",
+		queue="long",
+		timeout=3000,
+		enqueue_after_commit=True,
+		fee_schedule=fee_schedule,
+		user=frappe.session.user,
+	)
+
+
+def process_invoice_retries(fee_schedule, user=None):
+	"""Background job: retry every open failure of a Fee Schedule, one student at a time.
+
+	Each student is committed on its own, so a deadlock (which rolls back the whole
+	transaction) only loses that student's attempt, which is then repeated with an
+	exponential backoff. Other errors are recorded on the failure right away.
+	"""
+	from eduction_override.fees.consolidated_invoices import ConsolidatedInvoiceBuilder, get_consolidated_run
+	from eduction_override.fees.fee_schedule_override import FeeInvoiceBuilder
+
+	consolidated_run = get_consolidated_run(fee_schedule)
+	builder = (
+		ConsolidatedInvoiceBuilder(consolidated_run) if consolidated_run else FeeInvoiceBuilder(fee_schedule)
+	)
+	failures = frappe.get_all(
+		"Fee Invoice Failure",
+		filters={"fee_schedule": fee_schedule, "status": "Open"},
+		fields=["name", "student"],
+	)
+
+	resolved = 0
+	for failure in failures:
+		sales_invoice = frappe.db.get_value(
+			"Sales Invoice", {"fee_schedule": fee_schedule, "student": failure.student, "docstatus": ["<", 2]}
+		)
+		attempts = 0
+		error = error_message = None
+		while not sales_invoice and attempts < MAX_RETRY_ATTEMPTS:
+			if attempts:
+				time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1))
+			attempts += 1
+			try:
+				sales_invoice_doc = builder.make_invoice(failure.student)
+				sales_invoice_doc.insert()
+				sales_invoice = sales_invoice_doc.name
+			except Exception as e:
+				frappe.db.rollback()
+				error = e
+				error_message = "\n".join(cstr(m) for m in frappe.local.message_log) or cstr(e)
+				frappe.local.message_log = []
+				if not is_transient_error(e):
+					break
+
+		values = {"attempts": frappe.db.get_value("Fee Invoice Failure", failure.name, "attempts") + attempts}
+		if sales_invoice:
+			values.update({"status": "Resolved", "sales_invoice": sales_invoice})
+			resolved += 1
+		else:
+			values.update({"error_class": type(error).__name__, "error": error_message})
+		if attempts:
+			values["last_attempt"] = now()
+		frappe.db.set_value("Fee Invoice Failure", failure.name, values)
+		frappe.db.commit()
+
+	update_fee_schedule_after_retry(fee_schedule, resolved)
+	frappe.publish_realtime("fee_schedule_progress", {"progress": 100, "reload": 1}, user=user)
+
+
+def update_fee_schedule_after_retry(fee_schedule, resolved):
+	"""Move resolved students from the error to the created count and clear the status once none are left."""
+	frappe.db.sql(
+		"""
+		UPDATE `tabFee Schedule`
+		SET custom_invoices_created = custom_invoices_created + %(resolved)s,
+			custom_invoice_errors = GREATEST(custom_invoice_errors - %(resolved)s, 0)
+		WHERE name = %(fee_schedule)s
+	""",
+		{"fee_schedule": fee_schedule, "resolved": resolved},
+	)
+
+	if not frappe.db.exists("Fee Invoice Failure", {"fee_schedule": fee_schedule, "status": "Open"}):
+		frappe.db.set_value("Fee Schedule", fee_schedule, {"status": "Invoice Created", "error_log": None})
+	frappe.db.commit()
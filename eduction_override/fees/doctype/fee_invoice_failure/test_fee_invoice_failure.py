@@ -0,0 +1,113 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from eduction_override.fees.doctype.fee_invoice_failure.fee_invoice_failure import (
+	RETRY_BACKOFF_SECONDS,
+	is_transient_error,
+	process_invoice_retries,
+	record_invoice_failures,
+)
+from eduction_override.fees.fee_schedule_override import FeeInvoiceBuilder
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+
+class TestFeeInvoiceFailure(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=2, days_overdue=0)
+		cls.school.make()
+		cls.fee_schedule = cls.school.make_fee_schedules()[0]
+		cls.student = cls.school.created["Student"][0]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.school.delete()
+		super().tearDownClass()
+
+	def setUp(self):
+		# As left by a generation run in which only this student failed
+		record_invoice_failures(
+			self.fee_schedule,
+			[frappe._dict(student=self.student, error_class="QueryDeadlockError", error="Deadlock found")],
+		)
+		frappe.db.set_value(
+			"Fee Schedule",
+			self.fee_schedule,
+			{"status": "Failed", "custom_invoices_created": 1, "custom_invoice_errors": 1},
+		)
+		frappe.db.commit()
+
+	def tearDown(self):
+		delete_fee_invoices([self.fee_schedule])
+
+	def retry(self, errors):
+		"""Retry the open failures while make_invoice raises errors, in order; return the backoff delays."""
+		make_invoice = FeeInvoiceBuilder.make_invoice
+		errors = list(errors)
+
+		def flaky_make_invoice(builder, *args, **kwargs):
+			if errors:
+				raise errors.pop(0)
+			return make_invoice(builder, *args, **kwargs)
+
+		with (
+			patch.object(FeeInvoiceBuilder, "make_invoice", flaky_make_invoice),
+			patch("time.sleep") as sleep,
+		):
+			process_invoice_retries(self.fee_schedule)
+		return [call.args[0] for call in sleep.call_args_list]
+
+	def get_failure(self):
+		return frappe.get_doc(
+			"Fee Invoice Failure", {"fee_schedule": self.fee_schedule, "student": self.student}
+		)
+
+	def test_is_transient_error(self):
+		"""Test that only deadlocks and lock wait timeouts are worth retrying"""
+		self.assertTrue(is_transient_error(frappe.QueryDeadlockError("Deadlock found")))
+		self.assertTrue(is_transient_error(frappe.QueryTimeoutError("Lock wait timeout exceeded")))
+		self.assertFalse(is_transient_error(frappe.ValidationError("Customer is disabled")))
+
+	def test_transient_errors_are_retried_with_backoff(self):
+		"""Test that deadlocks are retried with an exponential backoff until the invoice is created"""
+		delays = self.retry(
+			[
+				frappe.QueryDeadlockError("Deadlock found"),
+				frappe.QueryTimeoutError("Lock wait timeout exceeded"),
+			]
+		)
+		self.assertEqual(delays, [RETRY_BACKOFF_SECONDS, 2 * RETRY_BACKOFF_SECONDS], "Delays should double")
+
+		failure = self.get_failure()
+		self.assertEqual(failure.status, "Resolved", "The failure should be resolved")
+		self.assertEqual(failure.attempts, 4, "The generation run and three retry attempts should be counted")
+		self.assertEqual(frappe.db.get_value("Sales Invoice", failure.sales_invoice, "student"), self.student)
+		self.assertEqual(
+			frappe.db.get_value(
+				"Fee Schedule",
+				self.fee_schedule,
+				["status", "custom_invoices_created", "custom_invoice_errors"],
+			),
+			("Invoice Created", 2, 0),
+			"The student should move from the error to the created count",
+		)
+
+	def test_other_errors_are_not_retried(self):
+		"""Test that an error other than a deadlock is recorded without retrying"""
+		delays = self.retry([frappe.ValidationError("Customer is disabled")])
+		self.assertEqual(delays, [], "There should be no backoff")
+
+		failure = self.get_failure()
+		self.assertEqual((failure.status, failure.attempts), ("Open", 2), "The failure should stay open")
+		self.assertEqual(failure.error_class, "ValidationError", "The new error should be recorded")
+		self.assertFalse(
+			frappe.db.exists("Sales Invoice", {"fee_schedule": self.fee_schedule, "student": self.student}),
+			"No invoice should be created",
+		)
+		self.assertEqual(frappe.db.get_value("Fee Schedule", self.fee_schedule, "status"), "Failed")
@@ -2,40 +2,117 @@
 # For license information, please see license.txt
 
 import frappe
+from frappe import _
+from frappe.utils import cint, cstr
 
 # Import the original function
 from education.education.doctype.fee_schedule import fee_schedule as fee_schedule_module
 
+from eduction_override.fees.doctype.fee_invoice_failure.fee_invoice_failure import record_invoice_failures
+from eduction_override.fees.invoice_bulk_insert import insert_invoices_in_bulk, reserve_series_names
 
-# Store the original function
+
+# Store the original functions
 _original_create_sales_invoice = fee_schedule_module.create_sales_invoice
+_original_generate_fees = fee_schedule_module.generate_fees
 
-def create_sales_invoice(fee_schedule, student_id, create_sales_order=False):
-	"""Override to copy late fine configuration from fee schedule to sales invoice."""
-	from education.education.doctype.fee_schedule.fee_schedule import get_customer_from_student, get_fees_mapped_doc
-	
-	# Get fee schedule to copy late fine configuration
-	fee_schedule_doc = frappe.get_doc("Fee Schedule", fee_schedule)
-	
-	# Create the invoice document (same as base function)
-	customer = get_customer_from_student(student_id)
-	
-	sales_invoice_doc = get_fees_mapped_doc(
-		fee_schedule=fee_schedule,
-		doctype="Sales Invoice",
-		student_id=student_id,
-		customer=customer,
-	)
+# Number of invoices committed together during generation. Can be changed per site
+# with the "fee_invoice_commit_batch_size" key in site_config.json.
+# Set "fee_invoice_fast_path": 1 to bulk insert invoices (see invoice_bulk_insert).
+DEFAULT_COMMIT_BATCH_SIZE = 50
+
+# Schedules with more students than this are split into shards of this size, each
+# generated by its own job on the long queue ("fee_invoice_shard_size" in site_config).
+DEFAULT_SHARD_SIZE = 500
+
+# Sales Invoice fields derived from the customer. They are cleared on every copy of
+# the template so that validation fills them in again for the student's customer.
+PARTY_FIELDS = (
+	"customer_name",
+	"title",
+	"customer_group",
+	"territory",
+	"tax_id",
+	"customer_address",
+	"address_display",
+	"contact_person",
+	"contact_display",
+	"contact_mobile",
+	"contact_email",
+	"shipping_address_name",
+	"shipping_address",
+	"language",
+)
+
+
+class FeeInvoiceBuilder:
+	"""Build draft Sales Invoices for the students of one Fee Schedule.
+
+	The Fee Schedule, Education Settings and the mapping to Sales Invoice are
+	processed once: the first invoice is mapped and calculated in full and kept
+	as a template, and every further invoice is a copy of it with only the
+	customer and student fields replaced.
+	"""
+
+	# Every invoice is a copy of the template, so the fast path can copy them in bulk
+	allow_bulk_insert = True
+
+	def __init__(self, fee_schedule):
+		self.fee_schedule = fee_schedule
+		self.fee_schedule_doc = frappe.get_doc("Fee Schedule", fee_schedule)
+		self.set_posting_time = cint(
+			frappe.get_cached_doc("Education Settings").get("sales_invoice_posting_date_fee_schedule")
+		)
+		self.template = None
+
+	def make_invoice(self, student_id, customer=None, student_name=None):
+		"""Return an unsaved, calculated Sales Invoice for the student."""
+		from education.education.doctype.fee_schedule.fee_schedule import get_customer_from_student
+
+		customer = customer or get_customer_from_student(student_id)
 
-	if frappe.db.get_single_value(
-		"Education Settings", "sales_invoice_posting_date_fee_schedule"
-	):
+		if self.template is None:
+			self.template = self._make_template(student_id, customer)
+			return frappe.copy_doc(self.template, ignore_no_copy=True)
+
+		sales_invoice_doc = frappe.copy_doc(self.template, ignore_no_copy=True)
+		for fieldname in PARTY_FIELDS:
+			if sales_invoice_doc.meta.has_field(fieldname):
+				sales_invoice_doc.set(fieldname, None)
+
+		sales_invoice_doc.customer = customer
+		sales_invoice_doc.student = student_id
+		sales_invoice_doc.student_name = student_name or frappe.db.get_value(
+			"Student", student_id, "student_name"
+		)
+		return sales_invoice_doc
+
+	def record_failures(self, failures):
+		record_invoice_failures(self.fee_schedule, failures)
+
+	def _make_template(self, student_id, customer):
+		from education.education.doctype.fee_schedule.fee_schedule import get_fees_mapped_doc
+
+		sales_invoice_doc = get_fees_mapped_doc(
+			fee_schedule=self.fee_schedule,
+			doctype="Sales Invoice",
+			student_id=student_id,
+			customer=customer,
+		)
+		apply_fee_schedule_defaults(sales_invoice_doc, self.fee_schedule_doc, self.set_posting_time)
+		return sales_invoice_doc
+
+
+def apply_fee_schedule_defaults(sales_invoice_doc, fee_schedule_doc, set_posting_time):
+	"""Apply the settings every invoice of a Fee Schedule shares and calculate totals."""
+	if set_posting_time:
 		sales_invoice_doc.set_posting_time = 1
 
 	for item in sales_invoice_doc.items:
 		item.qty = 1
 		item.cost_center = ""
-	
+		item.custom_fee_schedule = fee_schedule_doc.name
+
 	# Copy late fine configuration from fee schedule to sales invoice
 	if hasattr(fee_schedule_doc, 'custom_allow_late_fine'):
 		sales_invoice_doc.custom_has_late_fine = fee_schedule_doc.custom_allow_late_fine or 0
@@ -43,13 +120,379 @@ def create_sales_invoice(fee_schedule, student_id, create_sales_order=False):
 		sales_invoice_doc.custom_late_fine_amount = fee_schedule_doc.custom_late_fine_amount or 0
 		# Set late fine from date to the due date of the sales invoice
 		sales_invoice_doc.custom_late_fine_from = sales_invoice_doc.due_date
-	
+
 	# Calculate totals before saving
 	sales_invoice_doc.calculate_taxes_and_totals()
-	
+
+
+def create_sales_invoice(fee_schedule, student_id, create_sales_order=False):
+	"""Override to copy late fine configuration from fee schedule to sales invoice."""
+	sales_invoice_doc = FeeInvoiceBuilder(fee_schedule).make_invoice(student_id)
+
 	# Save the invoice (as draft, not submitted)
 	sales_invoice_doc.save()
 	frappe.db.commit()
 
 	return sales_invoice_doc.name
 
+
+def generate_fees(fee_schedule):
+	"""Override of education's generate_fees that builds all invoices from one template.
+
+	Schedules with more students than the shard size are split into shards that
+	are generated in parallel by the long queue workers (see generate_fees_shard).
+	Sales Orders (Education Settings > create_so) still go through the original
+	implementation. Schedules billed per student by a Bulk Fee Invoice Creation are
+	refused by CustomFeeSchedule.create_fees before this job is queued.
+
+	Batches are committed as they go, so a schedule that failed part way already has
+	some invoices. Running it again only bills the students left without one.
+	"""
+	if cint(frappe.get_cached_doc("Education Settings").get("create_so")):
+		return _original_generate_fees(fee_schedule)
+
+	builder = FeeInvoiceBuilder(fee_schedule)
+	invoiced_students = get_invoiced_students([fee_schedule])
+	students = get_schedule_students(builder.fee_schedule_doc, exclude=invoiced_students)
+
+	total_records = len(students)
+	if not total_records:
+		if not invoiced_students:
+			frappe.throw(_("Please setup Students under Student Groups"))
+		set_generation_status(fee_schedule, len(invoiced_students), [])
+		frappe.publish_realtime(
+			"fee_schedule_progress", {"progress": 100, "reload": 1}, user=frappe.session.user
+		)
+		return
+
+	shard_size = get_shard_size()
+	if total_records > shard_size:
+		enqueue_invoice_shards(fee_schedule, students, shard_size, invoiced=len(invoiced_students))
+		return
+
+	progress = frappe._dict(done=0)
+
+	def publish_batch_progress(created, failures):
+		progress.done += created + len(failures)
+		frappe.publish_realtime(
+			"fee_schedule_progress",
+			{"progress": int(progress.done * 100 / total_records)},
+			user=frappe.session.user,
+		)
+
+	created, failures = generate_invoices(builder, students, on_batch=publish_batch_progress)
+	set_generation_status(fee_schedule, len(invoiced_students) + created, failures)
+
+	frappe.publish_realtime(
+		"fee_schedule_progress", {"progress": 100, "reload": 1}, user=frappe.session.user
+	)
+
+
+def generate_invoices(builder, students, reserve_names=False, on_batch=None):
+	"""Create the draft invoices of students, committing every batch.
+
+	on_batch(created, failures) is called with each batch's results just before the
+	batch is committed. With reserve_names, the invoice names of all students are
+	reserved up front (see reserve_invoice_names). Returns (created, failures).
+	"""
+	batch_size = get_commit_batch_size()
+	use_fast_path = cint(frappe.conf.get("fee_invoice_fast_path"))
+	names = iter(reserve_invoice_names(builder, students) if reserve_names else ())
+
+	created = 0
+	failures = []
+	representative = None
+	for start in range(0, len(students), batch_size):
+		batch = students[start:start + batch_size]
+		batch_names = [next(names, None) for student in batch]
+		batch_failures = []
+
+		# Opt-in fast path: once one invoice went through the full ORM path, write
+		# the rest of the batch as copies of it with multi-row INSERTs
+		if use_fast_path and builder.allow_bulk_insert and representative and insert_batch_in_bulk(representative, batch, batch_names):
+			batch_created = len(batch)
+		else:
+			batch_created = 0
+			for student, name in zip(batch, batch_names):
+				sales_invoice_doc = create_student_invoice(builder, student, batch_failures, name=name)
+				if sales_invoice_doc:
+					batch_created += 1
+					representative = representative or sales_invoice_doc
+
+		created += batch_created
+		failures.extend(batch_failures)
+		builder.record_failures(batch_failures)
+		if on_batch:
+			on_batch(batch_created, batch_failures)
+		frappe.db.commit()
+
+	return created, failures
+
+
+def reserve_invoice_names(builder, students):
+	"""Reserve the invoice names of students as one block and commit straight away.
+
+	Naming an invoice locks its naming series row until the transaction commits, so
+	shards running in parallel would otherwise wait for each other's batches. Returns
+	an empty list if the series can't be reserved in one block; invoices are then
+	named one at a time as usual.
+	"""
+	first = students[0]
+	sample = builder.make_invoice(first.student, customer=first.customer, student_name=first.student_name)
+	names = reserve_series_names(sample, len(students))
+	frappe.db.commit()
+	return names or []
+
+
+def create_student_invoice(builder, student, failures, name=None):
+	"""Save one student's draft invoice inside a savepoint.
+
+	Returns the invoice, or None after rolling back only this student's writes and
+	adding them to failures.
+	"""
+	frappe.db.savepoint("fee_invoice")
+	try:
+		sales_invoice_doc = builder.make_invoice(
+			student.student, customer=student.customer, student_name=student.student_name
+		)
+		sales_invoice_doc.insert(set_name=name)
+		return sales_invoice_doc
+	except Exception as e:
+		frappe.db.rollback(save_point="fee_invoice")
+		failures.append(frappe._dict(
+			student=student.student,
+			error_class=type(e).__name__,
+			error=frappe.local.message_log and "\n".join(
+				cstr(m) for m in frappe.local.message_log
+			) or cstr(e),
+		))
+		frappe.local.message_log = []
+
+
+def insert_batch_in_bulk(representative, batch, names=None):
+	"""Bulk insert a batch of invoices as copies of representative.
+
+	Returns False (with the batch rolled back) if the fast path can't be used, so the
+	caller falls back to saving each invoice through the ORM.
+	"""
+	if not all(student.customer for student in batch):
+		return False
+
+	frappe.db.savepoint("fee_invoice_batch")
+	try:
+		insert_invoices_in_bulk(representative, batch, names=names if names and all(names) else None)
+		return True
+	except Exception:
+		frappe.db.rollback(save_point="fee_invoice_batch")
+		frappe.log_error(title=f"Fee invoice fast path failed for {representative.fee_schedule}")
+		return False
+
+
+def get_schedule_students(fee_schedule_doc, exclude=()):
+	"""Return the Fee Schedule's students as frappe._dicts of student, student_name and customer.
+
+	Students in exclude (e.g. those who already have an invoice) are left out.
+	"""
+	doc = fee_schedule_doc
+	students = []
+	for d in doc.student_groups:
+		students.extend(
+			student
+			for student in fee_schedule_module.get_students(
+				d.student_group, doc.academic_year, doc.academic_term, doc.student_category
+			)
+			if student.student not in exclude
+		)
+
+	# Resolve (and if needed create) every student's customer before generating
+	student_customers = get_student_customers([d.student for d in students])
+	for student in students:
+		student_customer = student_customers.get(student.student) or frappe._dict()
+		student.customer = student_customer.customer
+		student.student_name = student.student_name or student_customer.student_name
+
+	return students
+
+
+def get_student_customers(students):
+	"""Return a dict of Student -> frappe._dict(customer, student_name) for the students.
+
+	The students are resolved with a single query. Those without a customer get one
+	here, in one pass before invoice generation starts, so the per-student loop never
+	has to look up or create customers. The new customers are not committed here but
+	with the first batch of invoices (or when the shards are enqueued).
+	"""
+	from education.education.doctype.fee_schedule.fee_schedule import get_customer_from_student
+
+	students = list({student for student in students if student})
+	if not students:
+		return {}
+
+	rows = frappe.db.sql("""
+		SELECT name AS student, customer, student_name
+		FROM `tabStudent`
+		WHERE name IN %(students)s
+	""", {"students": students}, as_dict=True)
+
+	for d in rows:
+		if not d.customer:
+			d.customer = get_customer_from_student(d.student)
+
+	return {d.student: d for d in rows}
+
+
+def get_invoiced_students(fee_schedules):
+	"""Return the students who already have a draft or submitted invoice of one of fee_schedules."""
+	return set(
+		frappe.get_all(
+			"Sales Invoice",
+			filters={"fee_schedule": ["in", fee_schedules], "docstatus": ["<", 2]},
+			pluck="student",
+			distinct=True,
+		)
+	)
+
+
+def enqueue_invoice_shards(fee_schedule, students, shard_size, invoiced=0):
+	"""Split the students into shards and enqueue one generate_fees_shard job per shard.
+
+	invoiced is the number of students who already have an invoice of the schedule;
+	they count as created.
+	"""
+	shards = [students[start:start + shard_size] for start in range(0, len(students), shard_size)]
+
+	frappe.db.set_value(
+		"Fee Schedule",
+		fee_schedule,
+		{
+			"custom_invoice_shards": len(shards),
+			"custom_invoice_shards_completed": 0,
+			"custom_invoices_created": invoiced,
+			"custom_invoice_errors": 0,
+			"error_log": None,
+		},
+		update_modified=False,
+	)
+
+	for shard in shards:
+		frappe.enqueue(
+			"eduction_override.fees.fee_schedule_override.generate_fees_shard",
+			queue="long",
+			timeout=3000,
+			enqueue_after_commit=True,
+			fee_schedule=fee_schedule,
+			students=[
+				{"student": d.student, "student_name": d.student_name, "customer": d.customer}
+				for d in shard
+			],
+			total_students=invoiced + len(students),
+			user=frappe.session.user,
+		)
+	frappe.db.commit()
+
+
+def generate_fees_shard(fee_schedule, students, total_students, user=None):
+	"""Background job: create the invoices of one shard of a Fee Schedule's students.
+
+	Each committed batch adds its counts to the Fee Schedule, and the last shard to
+	finish sets the schedule's status. If the shard stops early, the students it
+	didn't get to are counted as errors so the schedule still gets finalized.
+	"""
+	students = [frappe._dict(d) for d in students]
+	progress = frappe._dict(done=0)
+
+	def record_batch(created, failures):
+		record_shard_progress(fee_schedule, created, failures, total_students, user)
+		progress.done += created + len(failures)
+
+	try:
+		builder = FeeInvoiceBuilder(fee_schedule)
+		generate_invoices(builder, students, reserve_names=True, on_batch=record_batch)
+	except Exception as e:
+		frappe.db.rollback()
+		frappe.log_error(title=f"Fee invoice shard failed for {fee_schedule}")
+		failures = [
+			frappe._dict(student=d.student, error_class=type(e).__name__, error=cstr(e))
+			for d in students[progress.done:]
+		]
+		record_invoice_failures(fee_schedule, failures)
+		record_shard_progress(fee_schedule, 0, failures, total_students, user)
+		frappe.db.commit()
+
+	complete_shard(fee_schedule, user)
+
+
+def record_shard_progress(fee_schedule, created, failures, total_students, user=None):
+	"""Add one batch's counts and errors to the Fee Schedule with atomic increments."""
+	frappe.db.sql("""
+		UPDATE `tabFee Schedule`
+		SET custom_invoices_created = custom_invoices_created + %(created)s,
+			custom_invoice_errors = custom_invoice_errors + %(errors)s,
+			error_log = CONCAT_WS('\n', NULLIF(error_log, ''), NULLIF(%(error_log)s, ''))
+		WHERE name = %(fee_schedule)s
+	""", {
+		"fee_schedule": fee_schedule,
+		"created": created,
+		"errors": len(failures),
+		"error_log": "\n".join(f"{d.student}: {d.error}" for d in failures),
+	})
+
+	done = frappe.db.sql("""
+		SELECT custom_invoices_created + custom_invoice_errors
+		FROM `tabFee Schedule` WHERE name = %s
+	""", fee_schedule)[0][0]
+	frappe.publish_realtime(
+		"fee_schedule_progress",
+		{"progress": min(int(cint(done) * 100 / total_students), 99)},
+		user=user,
+	)
+
+
+def complete_shard(fee_schedule, user=None):
+	"""Count a finished shard and, once it is the last one, set the Fee Schedule status."""
+	frappe.db.sql("""
+		UPDATE `tabFee Schedule`
+		SET custom_invoice_shards_completed = custom_invoice_shards_completed + 1
+		WHERE name = %s
+	""", fee_schedule)
+
+	# The UPDATE above holds the row lock, so exactly one shard sees the final count
+	doc = frappe.db.sql("""
+		SELECT status, custom_invoice_shards, custom_invoice_shards_completed, custom_invoice_errors
+		FROM `tabFee Schedule` WHERE name = %s FOR UPDATE
+	""", fee_schedule, as_dict=True)[0]
+
+	finished = doc.status == "In Process" and doc.custom_invoice_shards_completed >= doc.custom_invoice_shards
+	if finished:
+		frappe.db.set_value(
+			"Fee Schedule", fee_schedule, "status", "Failed" if doc.custom_invoice_errors else "Invoice Created"
+		)
+	frappe.db.commit()
+
+	if finished:
+		frappe.publish_realtime("fee_schedule_progress", {"progress": 100, "reload": 1}, user=user)
+
+
+def get_commit_batch_size():
+	return cint(frappe.conf.get("fee_invoice_commit_batch_size")) or DEFAULT_COMMIT_BATCH_SIZE
+
+
+def get_shard_size():
+	return cint(frappe.conf.get("fee_invoice_shard_size")) or DEFAULT_SHARD_SIZE
+
+
+def set_generation_status(fee_schedule, created, failures):
+	"""Set the Fee Schedule status and list the students whose invoice could not be created."""
+	values = {
+		"custom_invoice_shards": 0,
+		"custom_invoice_shards_completed": 0,
+		"custom_invoices_created": created,
+		"custom_invoice_errors": len(failures),
+	}
+	if failures:
+		error_log = "\n".join(f"{d.student}: {d.error}" for d in failures)
+		values.update({"status": "Failed", "error_log": error_log})
+	else:
+		values.update({"status": "Invoice Created", "error_log": None})
+	frappe.db.set_value("Fee Schedule", fee_schedule, values)
+	frappe.db.commit()
@@ -0,0 +1,175 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.naming import parse_naming_series
+from frappe.utils import cint, flt, now
+
+# Customer fields copied onto each bulk inserted invoice
+CUSTOMER_FIELDS = ("customer_name", "customer_group", "territory")
+
+# Fields that point to the representative's customer and can't be reused
+PARTY_LINK_FIELDS = (
+	"tax_id",
+	"customer_address",
+	"address_display",
+	"contact_person",
+	"contact_display",
+	"contact_mobile",
+	"contact_email",
+	"shipping_address_name",
+	"shipping_address",
+)
+
+
+def insert_invoices_in_bulk(representative, students, names=None):
+	"""Write draft copies of an inserted representative invoice with multi-row INSERTs.
+
+	representative is a Sales Invoice of the same Fee Schedule that went through
+	the full ORM path (validation, hooks). students is a list of dicts with
+	student, customer and student_name. Names are reserved from the naming series
+	in one block, parents and child rows are written with one INSERT per table, and
+	the written totals are checked against the representative before returning.
+	Pass names to use a block that was already reserved with reserve_series_names.
+
+	Document hooks (validate, on_update, ...) do not run for these copies, which is
+	why this path is opt-in; see generate_fees.
+	"""
+	if not students:
+		return []
+
+	names = names or reserve_series_names(representative, len(students))
+	if not names or len(names) != len(students):
+		frappe.throw(_("Naming series {0} can't be reserved in bulk").format(representative.naming_series))
+
+	customers = {
+		d.name: d
+		for d in frappe.get_all(
+			"Customer",
+			filters={"name": ["in", list({d.customer for d in students})]},
+			fields=["name", *CUSTOMER_FIELDS],
+		)
+	}
+
+	timestamp = now()
+	user = frappe.session.user
+	parents = []
+	children = {}
+	for name, student in zip(names, students, strict=True):
+		invoice = frappe.copy_doc(representative, ignore_no_copy=True)
+		invoice.name = name
+		invoice.customer = student.customer
+		invoice.student = student.student
+		invoice.student_name = student.student_name
+
+		customer = customers.get(student.customer) or frappe._dict()
+		for fieldname in CUSTOMER_FIELDS:
+			invoice.set(fieldname, customer.get(fieldname))
+		invoice.title = invoice.customer_name or student.customer
+		for fieldname in PARTY_LINK_FIELDS:
+			if invoice.meta.has_field(fieldname):
+				invoice.set(fieldname, None)
+
+		for d in [invoice, *invoice.get_all_children()]:
+			d.owner = d.modified_by = user
+			d.creation = d.modified = timestamp
+			d.docstatus = 0
+
+		parents.append(invoice.get_valid_dict(convert_dates_to_str=True, ignore_nulls=False))
+		for child in invoice.get_all_children():
+			child.name = frappe.generate_hash(length=10)
+			child.parent = invoice.name
+			children.setdefault(child.doctype, []).append(
+				child.get_valid_dict(convert_dates_to_str=True, ignore_nulls=False)
+			)
+
+	insert_rows(representative.doctype, parents)
+	for doctype, rows in children.items():
+		insert_rows(doctype, rows)
+
+	check_bulk_inserted_invoices(representative, names)
+	return names
+
+
+def insert_rows(doctype, rows):
+	"""Write rows (dicts of fieldname -> value) of doctype with one multi-row INSERT."""
+	fields = sorted({fieldname for row in rows for fieldname in row})
+	frappe.db.bulk_insert(
+		doctype,
+		fields=fields,
+		values=[tuple(row.get(fieldname) for fieldname in fields) for row in rows],
+	)
+
+
+def check_bulk_inserted_invoices(representative, names):
+	"""Raise if the written invoices don't add up to copies of the representative."""
+	totals = frappe.db.sql(
+		"""
+		SELECT COUNT(*), SUM(grand_total), SUM(outstanding_amount)
+		FROM `tabSales Invoice`
+		WHERE name IN %(names)s AND docstatus = 0
+	""",
+		{"names": names},
+	)[0]
+	items = frappe.db.sql(
+		"""
+		SELECT COUNT(*), SUM(amount)
+		FROM `tabSales Invoice Item`
+		WHERE parenttype = 'Sales Invoice' AND parent IN %(names)s
+	""",
+		{"names": names},
+	)[0]
+
+	count = len(names)
+	precision = representative.precision("grand_total")
+	expected = (
+		count,
+		flt(representative.grand_total * count, precision),
+		flt(representative.outstanding_amount * count, precision),
+		len(representative.items) * count,
+		flt(sum(flt(d.amount) for d in representative.items) * count, precision),
+	)
+	actual = (
+		cint(totals[0]),
+		flt(totals[1], precision),
+		flt(totals[2], precision),
+		cint(items[0]),
+		flt(items[1], precision),
+	)
+	if actual != expected:
+		frappe.throw(
+			_(
+				"Bulk inserted invoices don't match the representative invoice {0}: expected {1}, got {2}"
+			).format(representative.name, expected, actual)
+		)
+
+
+def reserve_series_names(doc, count):
+	"""Reserve count consecutive names from the naming series of doc.
+
+	The series counter is moved forward once for the whole block. Returns None if
+	the series can't be reserved in one block (no naming_series, or the number
+	isn't the last part of the series).
+	"""
+	series = doc.get("naming_series")
+	if not series:
+		return None
+	if "#" not in series:
+		series = series.rstrip(".") + ".#####"
+
+	parts = series.split(".")
+	digits = parts[-1]
+	if set(digits) != {"#"} or any("#" in part for part in parts[:-1]):
+		return None
+
+	prefix = parse_naming_series(parts[:-1], doc=doc)
+	current = frappe.db.sql("SELECT `current` FROM `tabSeries` WHERE `name`=%s FOR UPDATE", prefix)
+	if current:
+		start = cint(current[0][0])
+		frappe.db.sql("UPDATE `tabSeries` SET `current` = `current` + %s WHERE `name`=%s", (count, prefix))
+	else:
+		start = 0
+		frappe.db.sql("INSERT INTO `tabSeries` (`name`, `current`) VALUES (%s, %s)", (prefix, count))
+
+	return [prefix + str(start + i).zfill(len(digits)) for i in range(1, count + 1)]
@@ -0,0 +1,38 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+class RunLookups:
+	"""Memoize reference documents and company defaults for the duration of one run.
+
+	Create one instance per bulk run (or per background job) and pass it around;
+	each distinct document or default is then read from the database only once.
+	Documents returned by get_doc are shared, so callers must not modify them.
+	"""
+
+	def __init__(self):
+		self._docs = {}
+		self._company_currency = {}
+		self._default_currency = None
+
+	def get_doc(self, doctype, name):
+		key = (doctype, name)
+		if key not in self._docs:
+			self._docs[key] = frappe.get_doc(doctype, name)
+		return self._docs[key]
+
+	def get_company_currency(self, company):
+		if company not in self._company_currency:
+			import erpnext
+
+			self._company_currency[company] = erpnext.get_company_currency(company)
+		return self._company_currency[company]
+
+	def get_default_currency(self):
+		if self._default_currency is None:
+			self._default_currency = (
+				frappe.db.get_single_value("System Settings", "default_currency") or "USD"
+			)
+		return self._default_currency
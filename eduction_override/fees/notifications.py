@@ -0,0 +1,133 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import add_to_date, cint, flt, now_datetime
+
+from eduction_override.fees.bulk_submit import get_fee_schedules
+
+# Emails queued together, and the seconds between the send times of two batches.
+# Can be changed per site with the "fee_notification_batch_size" and
+# "fee_notification_batch_interval" keys in site_config.json.
+DEFAULT_NOTIFICATION_BATCH_SIZE = 100
+DEFAULT_NOTIFICATION_BATCH_INTERVAL = 60
+
+DEFAULT_NOTIFICATION_TEMPLATE = "eduction_override/templates/emails/fee_invoice_notification.html"
+
+
+@frappe.whitelist()
+def send_fee_notifications(fee_schedule=None, bulk_fee_invoice_creation=None):
+	"""Queue the notification stage of a Fee Schedule or bulk run from its form."""
+	if not (fee_schedule or bulk_fee_invoice_creation):
+		frappe.throw(_("Select a Fee Schedule or a Bulk Fee Invoice Creation"))
+	frappe.has_permission("Sales Invoice", "email", throw=True)
+
+	enqueue_fee_notifications(fee_schedule, bulk_fee_invoice_creation)
+
+
+def enqueue_fee_notifications(fee_schedule=None, bulk_fee_invoice_creation=None):
+	frappe.enqueue(
+		"eduction_override.fees.notifications.process_fee_notifications",
+		queue="long",
+		timeout=3000,
+		enqueue_after_commit=True,
+		fee_schedule=fee_schedule,
+		bulk_fee_invoice_creation=bulk_fee_invoice_creation,
+	)
+
+
+def process_fee_notifications(fee_schedule=None, bulk_fee_invoice_creation=None):
+	"""Background job: email every student their not yet notified invoices of a Fee Schedule or bulk run.
+
+	Only submitted invoices are emailed: drafts can still be edited or deleted. The
+	stage is queued when a bulk submit of the same scope finishes (see
+	bulk_submit.submit_invoice_chunk), or from the form. Students get one email
+	listing all their invoices in scope. The template is
+	compiled once, and emails go to the email queue in batches whose send times
+	are spread by the batch interval. Invoices are flagged as notified batch by
+	batch, so the stage can be run again without sending anything twice. Students
+	without an email address are left unflagged, so they are emailed by a later
+	run once they have one.
+	"""
+	fee_schedules = frappe.get_all(
+		"Fee Schedule",
+		filters={"name": ["in", get_fee_schedules(fee_schedule, bulk_fee_invoice_creation) or [""]], "send_email": 1},
+		pluck="name",
+	)
+	if not fee_schedules:
+		return 0
+
+	invoices = frappe.db.sql("""
+		SELECT si.name, si.student, si.student_name, si.due_date, si.currency,
+			si.grand_total, si.outstanding_amount, s.student_email_id
+		FROM `tabSales Invoice` si
+		INNER JOIN `tabStudent` s ON s.name = si.student
+		WHERE si.fee_schedule IN %(fee_schedules)s AND si.docstatus = 1
+			AND IFNULL(si.custom_fee_notification_sent, 0) = 0
+		ORDER BY si.student, si.due_date, si.name
+	""", {"fee_schedules": fee_schedules}, as_dict=True)
+
+	students = {}
+	for invoice in invoices:
+		students.setdefault(invoice.student, []).append(invoice)
+
+	subject_template, message_template = get_notification_templates()
+	batch_size = cint(frappe.conf.get("fee_notification_batch_size")) or DEFAULT_NOTIFICATION_BATCH_SIZE
+	interval = cint(frappe.conf.get("fee_notification_batch_interval") or DEFAULT_NOTIFICATION_BATCH_INTERVAL)
+
+	student_invoices = list(students.values())
+	sent = 0
+	for batch_no, start in enumerate(range(0, len(student_invoices), batch_size)):
+		send_after = add_to_date(now_datetime(), seconds=batch_no * interval) if batch_no else None
+		notified = []
+		for invoices in student_invoices[start:start + batch_size]:
+			first = invoices[0]
+			if not first.student_email_id:
+				continue
+
+			context = {
+				"student": first.student,
+				"student_name": first.student_name,
+				"invoices": invoices,
+				"total": sum(flt(d.outstanding_amount) for d in invoices),
+				"currency": first.currency,
+			}
+			frappe.sendmail(
+				recipients=[first.student_email_id],
+				subject=subject_template.render(context),
+				message=message_template.render(context),
+				reference_doctype="Sales Invoice",
+				reference_name=first.name,
+				send_after=send_after,
+			)
+			notified.extend(d.name for d in invoices)
+			sent += 1
+
+		if notified:
+			frappe.db.sql("""
+				UPDATE `tabSales Invoice` SET custom_fee_notification_sent = 1 WHERE name IN %(names)s
+			""", {"names": notified})
+		frappe.db.commit()
+
+	return sent
+
+
+def get_notification_templates():
+	"""Return the compiled (subject, message) Jinja templates of the fee notification.
+
+	An Email Template can be set with the "fee_notification_email_template" key in
+	site_config.json; otherwise the app's default template is used.
+	"""
+	jenv = frappe.get_jenv()
+
+	email_template = frappe.conf.get("fee_notification_email_template")
+	if email_template:
+		doc = frappe.get_cached_doc("Email Template", email_template)
+		message = doc.response_html if doc.use_html else doc.response
+		return jenv.from_string(doc.subject), jenv.from_string(message)
+
+	return (
+		jenv.from_string(_("Fee Invoice for {{ student_name }}")),
+		jenv.get_template(DEFAULT_NOTIFICATION_TEMPLATE),
+	)
@@ -0,0 +1,24 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	"""Add the flag the fee notification stage sets once an invoice has been emailed."""
+	create_custom_fields(
+		{
+			"Sales Invoice": [
+				{
+					"fieldname": "custom_fee_notification_sent",
+					"label": "Fee Notification Sent",
+					"fieldtype": "Check",
+					"insert_after": "fee_schedule",
+					"read_only": 1,
+					"no_copy": 1,
+					"print_hide": 1,
+				},
+			]
+		},
+		ignore_validate=True,
+	)
@@ -0,0 +1,24 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	"""Add the Fee Schedule reference kept on every fee invoice item."""
+	create_custom_fields(
+		{
+			"Sales Invoice Item": [
+				{
+					"fieldname": "custom_fee_schedule",
+					"label": "Fee Schedule",
+					"fieldtype": "Link",
+					"options": "Fee Schedule",
+					"insert_after": "item_name",
+					"read_only": 1,
+					"print_hide": 1,
+				},
+			]
+		},
+		ignore_validate=True,
+	)
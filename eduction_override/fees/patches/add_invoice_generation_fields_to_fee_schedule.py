@@ -0,0 +1,52 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	"""Add the counters that sharded invoice generation rolls up onto the Fee Schedule."""
+	counter = {"fieldtype": "Int", "read_only": 1, "no_copy": 1, "default": "0"}
+	create_custom_fields(
+		{
+			"Fee Schedule": [
+				{
+					"fieldname": "custom_invoice_generation_section",
+					"label": "Invoice Generation",
+					"fieldtype": "Section Break",
+					"insert_after": "error_log",
+					"collapsible": 1,
+				},
+				{
+					**counter,
+					"fieldname": "custom_invoice_shards",
+					"label": "Shards",
+					"insert_after": "custom_invoice_generation_section",
+				},
+				{
+					**counter,
+					"fieldname": "custom_invoice_shards_completed",
+					"label": "Shards Completed",
+					"insert_after": "custom_invoice_shards",
+				},
+				{
+					"fieldname": "custom_invoice_generation_column",
+					"fieldtype": "Column Break",
+					"insert_after": "custom_invoice_shards_completed",
+				},
+				{
+					**counter,
+					"fieldname": "custom_invoices_created",
+					"label": "Invoices Created",
+					"insert_after": "custom_invoice_generation_column",
+				},
+				{
+					**counter,
+					"fieldname": "custom_invoice_errors",
+					"label": "Invoice Errors",
+					"insert_after": "custom_invoices_created",
+				},
+			]
+		},
+		ignore_validate=True,
+	)
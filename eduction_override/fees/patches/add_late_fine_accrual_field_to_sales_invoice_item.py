@@ -0,0 +1,55 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	"""Add the flag for the late fine rows added by the late fine job, and flag existing ones.
+
+	Only rows the job added before are flagged. Fee component rows of older invoices
+	carry no Fee Schedule either (custom_fee_schedule was never backfilled), so a row
+	is flagged when it bills the invoice's late fine amount, which the job always used
+	as the rate, and doesn't match a component of the invoice's Fee Schedule. A row
+	that matches both is left alone: the job then adds a new row instead of accruing
+	on what may be a fee component.
+	"""
+	create_custom_fields(
+		{
+			"Sales Invoice Item": [
+				{
+					"fieldname": "custom_late_fine_accrual",
+					"label": "Late Fine Accrual",
+					"fieldtype": "Check",
+					"insert_after": "custom_fee_schedule",
+					"read_only": 1,
+					"print_hide": 1,
+					"no_copy": 1,
+				},
+			]
+		},
+		ignore_validate=True,
+	)
+
+	frappe.db.sql("""
+		UPDATE `tabSales Invoice Item` sii
+		INNER JOIN `tabSales Invoice` si ON si.name = sii.parent
+		SET sii.custom_late_fine_accrual = 1
+		WHERE sii.parenttype = 'Sales Invoice'
+			AND si.docstatus = 0
+			AND si.custom_has_late_fine = 1
+			AND IFNULL(sii.custom_fee_schedule, '') = ''
+			AND (
+				sii.item_code LIKE %(late_fine)s
+				OR sii.item_name LIKE %(late_fine)s
+				OR sii.description LIKE %(late_fine)s
+			)
+			AND sii.rate = si.custom_late_fine_amount
+			AND NOT EXISTS (
+				SELECT 1
+				FROM `tabFee Component` fc
+				WHERE fc.parent = si.fee_schedule AND fc.parenttype = 'Fee Schedule'
+					AND fc.item = sii.item_code AND fc.amount = sii.rate
+			)
+	""", {"late_fine": "%Late Fine%"})
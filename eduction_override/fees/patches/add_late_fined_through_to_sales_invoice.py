@@ -0,0 +1,48 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+	"""Add the date late fines are billed through, and fill it in for existing invoices.
+
+	Invoices with a late fine are fined through their due date plus the units on
+	their late fine rows (one row per day before fines were accrued on one row).
+	"""
+	create_custom_fields(
+		{
+			"Sales Invoice": [
+				{
+					"fieldname": "custom_late_fined_through",
+					"label": "Late Fined Through",
+					"fieldtype": "Date",
+					"insert_after": "custom_late_fine_from",
+					"read_only": 1,
+					"no_copy": 1,
+					"search_index": 1,
+				},
+			]
+		},
+		ignore_validate=True,
+	)
+
+	frappe.db.sql("""
+		UPDATE `tabSales Invoice` si
+		LEFT JOIN (
+			SELECT sii.parent, SUM(sii.qty) AS units
+			FROM `tabSales Invoice Item` sii
+			WHERE sii.parenttype = 'Sales Invoice'
+				AND (
+					sii.item_code LIKE %(late_fine)s
+					OR sii.item_name LIKE %(late_fine)s
+					OR sii.description LIKE %(late_fine)s
+				)
+			GROUP BY sii.parent
+		) fines ON fines.parent = si.name
+		SET si.custom_late_fined_through = DATE_ADD(si.due_date, INTERVAL CEIL(IFNULL(fines.units, 0)) DAY)
+		WHERE si.custom_has_late_fine = 1
+			AND si.custom_late_fined_through IS NULL
+			AND si.due_date IS NOT NULL
+	""", {"late_fine": "%Late Fine%"})
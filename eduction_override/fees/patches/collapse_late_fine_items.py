@@ -0,0 +1,68 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import flt
+
+from eduction_override.fees.tasks import is_late_fine_item
+
+
+def execute():
+	"""Merge the one-row-per-day late fine items of draft invoices into a single row.
+
+	Daily late fines are now accrued on one row whose qty is the number of days
+	fined. Rows of the same item, rate and discount are merged into the first of
+	them. Submitted invoices are left alone, since their ledger entries are posted.
+	"""
+	invoices = frappe.db.sql_list("""
+		SELECT sii.parent
+		FROM `tabSales Invoice Item` sii
+		INNER JOIN `tabSales Invoice` si ON si.name = sii.parent
+		WHERE sii.parenttype = 'Sales Invoice' AND si.docstatus = 0
+			AND (
+				sii.item_code LIKE %(late_fine)s
+				OR sii.item_name LIKE %(late_fine)s
+				OR sii.description LIKE %(late_fine)s
+			)
+		GROUP BY sii.parent
+		HAVING COUNT(*) > 1
+	""", {"late_fine": "%Late Fine%"})
+
+	for invoice_name in invoices:
+		try:
+			invoice_doc = frappe.get_doc("Sales Invoice", invoice_name)
+			if collapse_late_fine_rows(invoice_doc):
+				invoice_doc.calculate_taxes_and_totals()
+				invoice_doc.save()
+				frappe.db.commit()
+		except Exception:
+			frappe.db.rollback()
+			frappe.log_error(title=f"Could not collapse late fine rows of {invoice_name}")
+
+
+def collapse_late_fine_rows(invoice_doc):
+	"""Merge repeated late fine rows of invoice_doc; return True if any row was merged."""
+	kept = {}
+	items = []
+	for item in invoice_doc.items:
+		if not is_late_fine_item(item):
+			items.append(item)
+			continue
+
+		key = (item.item_code, item.item_name, flt(item.rate), flt(item.discount_percentage))
+		if key not in kept:
+			kept[key] = item
+			items.append(item)
+			continue
+
+		row = kept[key]
+		row.qty = flt(row.qty) + flt(item.qty)
+		row.amount = flt(row.amount) + flt(item.amount)
+
+	if len(items) == len(invoice_doc.items):
+		return False
+
+	invoice_doc.set("items", items)
+	for idx, item in enumerate(invoice_doc.items, start=1):
+		item.idx = idx
+	return True
@@ -0,0 +1,97 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from functools import partial
+
+import frappe
+from frappe.query_builder.functions import Count
+from frappe.utils import cint
+
+
+def get_active_student_counts(student_groups):
+	"""Return a dict of Student Group -> number of active students.
+
+	All groups are counted with a single grouped query, so callers can ask for
+	every section of a bulk run at once instead of counting one group at a time.
+	Groups without any active student are returned with a count of 0.
+	"""
+	student_groups = list({group for group in student_groups or [] if group})
+	if not student_groups:
+		return {}
+
+	counts = dict.fromkeys(student_groups, 0)
+
+	sgs = frappe.qb.DocType("Student Group Student")
+	rows = (
+		frappe.qb.from_(sgs)
+		.select(sgs.parent, Count(sgs.name).as_("student_count"))
+		.where((sgs.parent.isin(student_groups)) & (sgs.active == 1))
+		.groupby(sgs.parent)
+	).run(as_dict=True)
+
+	for row in rows:
+		counts[row.parent] = cint(row.student_count)
+
+	return counts
+
+
+# Redis hash holding {"total_students": ..., "program": ...} for each Student Group.
+# The hash expires an hour after it is started, which bounds how long a summary can
+# stay stale after a change that no hook sees (e.g. a direct SQL update).
+STUDENT_GROUP_SUMMARY_CACHE = "eduction_override:student_group_summary"
+STUDENT_GROUP_SUMMARY_EXPIRY = 60 * 60
+
+
+def get_student_group_summaries(student_groups):
+	"""Return a dict of Student Group -> frappe._dict(total_students, program).
+
+	Summaries are kept in a shared cache, so repeated Fee Schedule validations don't
+	query the database. Groups missing from the cache are loaded together with one
+	grouped count and one program lookup. The cache is cleared by the Student Group
+	and Student Group Student hooks in clear_student_group_cache.
+	"""
+	student_groups = list({group for group in student_groups or [] if group})
+	cache = frappe.cache()
+
+	summaries = {}
+	missing = []
+	for group in student_groups:
+		summary = cache.hget(STUDENT_GROUP_SUMMARY_CACHE, group)
+		if summary is None:
+			missing.append(group)
+		else:
+			summaries[group] = frappe._dict(summary)
+
+	if missing:
+		counts = get_active_student_counts(missing)
+		programs = dict(
+			frappe.get_all(
+				"Student Group",
+				filters={"name": ["in", missing]},
+				fields=["name", "program"],
+				as_list=True
+			)
+		)
+		for group in missing:
+			summary = {"total_students": counts.get(group, 0), "program": programs.get(group)}
+			cache.hset(STUDENT_GROUP_SUMMARY_CACHE, group, summary)
+			summaries[group] = frappe._dict(summary)
+
+		# Only set when the hash is started, so refilling it doesn't keep old entries
+		key = cache.make_key(STUDENT_GROUP_SUMMARY_CACHE)
+		if cache.ttl(key) < 0:
+			cache.expire(key, STUDENT_GROUP_SUMMARY_EXPIRY)
+
+	return summaries
+
+
+def clear_student_group_cache(doc, method=None):
+	"""Drop the cached summary of a Student Group when it (or one of its students) changes.
+
+	Hooked on Student Group and on Student Group Student, for rows saved or deleted
+	on their own. The summary is dropped once the change is committed, so a reader
+	can't cache the old values again in between, and not at all on a rollback.
+	"""
+	student_group = doc.parent if doc.doctype == "Student Group Student" else doc.name
+	if student_group:
+		frappe.db.after_commit.add(partial(frappe.cache().hdel, STUDENT_GROUP_SUMMARY_CACHE, student_group))
@@ -3,108 +3,226 @@
 
 import frappe
 from frappe import _
-from frappe.utils import today, getdate, flt
-from datetime import timedelta
+from frappe.utils import today, getdate, flt, cint
+
+from eduction_override.fees.late_fine_accrual import FINE_FREQUENCIES, calculate_accruals, fine_units_owed
+
+
+# Overdue invoices handled by one background job of the daily late fine run. Can be
+# changed per site with the "late_fine_chunk_size" key in site_config.json.
+DEFAULT_LATE_FINE_CHUNK_SIZE = 200
+
+# Redis hash of {chunk number: counts} for each late fine run, read by the summary step.
+# The keys of a run expire after a day, so a run whose chunk died doesn't leave them behind.
+LATE_FINE_RUN_CACHE = "eduction_override:late_fine_run"
+LATE_FINE_RUN_EXPIRY = 24 * 60 * 60
 
 
 def daily():
 	"""Daily scheduler to add late fine items to overdue sales invoices based on fine frequency."""
-	process_late_fines_for_overdue_invoices()
+	enqueue_late_fine_chunks()
+
+
+def enqueue_late_fine_chunks():
+	"""Split the invoices that owe late fines into chunks, each processed by a long queue job.
+	
+	Every chunk commits its invoices on its own and records its counts; the last
+	chunk to finish writes the summary of the whole run (see summarize_late_fine_run).
+	"""
+	invoices = [d.name for d in get_pending_late_fines(today())]
+	if not invoices:
+		return
+	
+	chunk_size = cint(frappe.conf.get("late_fine_chunk_size")) or DEFAULT_LATE_FINE_CHUNK_SIZE
+	chunks = [invoices[start:start + chunk_size] for start in range(0, len(invoices), chunk_size)]
+	run_id = frappe.generate_hash(length=10)
+	
+	# Start the run's chunk counter with its expiry; incrementing it keeps the expiry
+	cache = frappe.cache()
+	cache.set(cache.make_key(f"{LATE_FINE_RUN_CACHE}:{run_id}:done"), 0, ex=LATE_FINE_RUN_EXPIRY)
+	
+	for chunk_no, chunk in enumerate(chunks, start=1):
+		frappe.enqueue(
+			"eduction_override.fees.tasks.process_late_fine_chunk",
+			queue="long",
+			timeout=3000,
+			run_id=run_id,
+			chunk_no=chunk_no,
+			chunk_count=len(chunks),
+			invoices=chunk,
+		)
+
+
+def process_late_fine_chunk(run_id, chunk_no, chunk_count, invoices):
+	"""Background job: apply the late fines of one chunk of invoices and record its counts.
+	
+	The units owed are worked out again for the chunk's invoices, so a chunk that
+	runs late (or twice) never fines an invoice twice for the same day.
+	"""
+	try:
+		counts = process_late_fines_for_overdue_invoices(invoices)
+	except Exception:
+		frappe.db.rollback()
+		frappe.log_error(title=f"Late fine chunk {chunk_no}/{chunk_count} failed")
+		counts = frappe._dict(processed=0, skipped=0, errors=len(invoices))
+	
+	record_late_fine_chunk(run_id, chunk_no, chunk_count, counts)
+
+
+def record_late_fine_chunk(run_id, chunk_no, chunk_count, counts):
+	"""Store a chunk's counts and run the summary step once every chunk of the run is recorded."""
+	cache = frappe.cache()
+	run_key = f"{LATE_FINE_RUN_CACHE}:{run_id}"
+	done_key = cache.make_key(f"{run_key}:done")
+	
+	cache.hset(run_key, chunk_no, dict(counts))
+	cache.expire(cache.make_key(run_key), LATE_FINE_RUN_EXPIRY)
+	# Atomic, so exactly one chunk sees the final count
+	done = cache.incr(done_key)
+	
+	if done == chunk_count:
+		summarize_late_fine_run(run_id, chunk_count)
+
+
+def summarize_late_fine_run(run_id, chunk_count):
+	"""Log the totals and per-chunk counts of a late fine run."""
+	cache = frappe.cache()
+	run_key = f"{LATE_FINE_RUN_CACHE}:{run_id}"
+	chunks = {int(chunk_no): counts for chunk_no, counts in (cache.hgetall(run_key) or {}).items()}
+	
+	totals = {
+		key: sum(counts.get(key, 0) for counts in chunks.values())
+		for key in ("processed", "skipped", "errors")
+	}
+	lines = [
+		f"Processed: {totals['processed']}, Skipped: {totals['skipped']}, Errors: {totals['errors']}",
+		f"Chunks: {chunk_count}",
+	]
+	for chunk_no in sorted(chunks):
+		counts = chunks[chunk_no]
+		lines.append(
+			f"Chunk {chunk_no}: Processed: {counts.get('processed', 0)}, "
+			f"Skipped: {counts.get('skipped', 0)}, Errors: {counts.get('errors', 0)}"
+		)
+	
+	if totals["processed"] > 0 or totals["errors"] > 0:
+		frappe.log_error(title="Late Fine Scheduler Summary", message="\n".join(lines))
+	
+	cache.delete_value(run_key)
+	cache.delete(cache.make_key(f"{run_key}:done"))
 
 
-def process_late_fines_for_overdue_invoices():
+def process_late_fines_for_overdue_invoices(invoices=None):
 	"""Process late fines for overdue invoices based on custom_fine_frequency.
 	
 	Logic:
 	- If custom_fine_frequency is "Once" and invoice is overdue: add fine once, skip if already added
-	- If custom_fine_frequency is "Daily" or "Per Day" and invoice is overdue: add fine amount each day
-	"""
-	current_date = today()
+	- If custom_fine_frequency is "Daily" / "Per Day", "Weekly" or "Monthly" and invoice is
+	  overdue: add fine amount for each day, week or month it is overdue
 	
-	# Find all overdue sales invoices with late fine configuration
-	# Check custom_payment_status instead of status
-	# Only process draft invoices (not submitted or cancelled)
-	overdue_invoices = frappe.get_all(
-		"Sales Invoice",
-		filters={
-			"custom_payment_status": ["in", ["Overdue", "Unpaid"]],  # Check custom_payment_status
-			"custom_has_late_fine": 1,
-			"custom_late_fine_amount": [">", 0],
-			"docstatus": 0  # Only draft invoices (not submitted or cancelled)
-		},
-		fields=[
-			"name", 
-			"custom_late_fine_amount", 
-			"custom_fine_frequency",
-			"due_date",
-			"fee_schedule"
-		]
-	)
+	The invoices that owe fines, and how many units each, are worked out in one pass
+	(get_pending_late_fines), so only invoices that change are loaded and saved.
+	Pass invoices to limit the run to those names (as the chunk jobs do); a run over
+	all invoices logs its own summary. Returns the processed, skipped and error counts.
+	"""
+	pending_fines = get_pending_late_fines(today(), invoices)
+	counts = frappe._dict(processed=0, skipped=0, errors=0)
 	
-	if not overdue_invoices:
-		return
+	if not pending_fines:
+		return counts
 	
-	processed_count = 0
-	skipped_count = 0
-	error_count = 0
+	late_fine_items = {}
 	
-	for invoice_data in overdue_invoices:
+	for invoice_data in pending_fines:
 		invoice_name = invoice_data.name
-		late_fine_amount = invoice_data.custom_late_fine_amount or 0
-		fine_frequency = invoice_data.custom_fine_frequency or "Once"
-		due_date = invoice_data.due_date
 		fee_schedule_name = invoice_data.fee_schedule
 		
-		# Skip if amount is zero
-		if late_fine_amount <= 0:
-			continue
-		
-		# Check if invoice is actually overdue (due_date < today)
-		if due_date and getdate(due_date) >= getdate(current_date):
-			# Not overdue yet, skip
-			continue
-		
 		try:
-			# Check current payment status to ensure it's still overdue
-			current_payment_status = frappe.db.get_value("Sales Invoice", invoice_name, "custom_payment_status")
-			if current_payment_status not in ["Overdue", "Unpaid"]:
-				# Status changed, skip
-				continue
+			if fee_schedule_name not in late_fine_items:
+				late_fine_items[fee_schedule_name] = get_late_fine_item(fee_schedule_name)
+			late_fine_item = late_fine_items[fee_schedule_name]
 			
-			if fine_frequency == "Once":
-				# Add fine once, skip if already added
-				added = add_late_fine_once(invoice_name, late_fine_amount, fee_schedule_name)
-				if added:
-					processed_count += 1
-				else:
-					skipped_count += 1
-			elif fine_frequency in ["Daily", "Per Day"]:
-				# Add fine amount each day
-				added = add_late_fine_daily(invoice_name, late_fine_amount, fee_schedule_name, due_date)
-				if added:
-					processed_count += 1
-				else:
-					skipped_count += 1
+			if invoice_data.fine_frequency == "Once":
+				added = add_late_fine_once(
+					invoice_name, invoice_data.fine_amount, fee_schedule_name, late_fine_item
+				)
+			else:
+				added = add_late_fine_recurring(
+					invoice_name,
+					invoice_data.fine_amount,
+					fee_schedule_name,
+					invoice_data.due_date,
+					invoice_data.fine_frequency,
+					units=invoice_data.units,
+					late_fine_item=late_fine_item,
+				)
+			if added:
+				counts.processed += 1
 			else:
-				# Unknown frequency, skip
-				skipped_count += 1
+				counts.skipped += 1
 				
 		except Exception as e:
-			error_count += 1
+			frappe.db.rollback()
+			counts.errors += 1
 			frappe.log_error(
 				title=f"Error processing late fine for invoice {invoice_name}",
-				message=f"Error: {str(e)}\nFrequency: {fine_frequency}"
+				message=f"Error: {str(e)}\nFrequency: {invoice_data.fine_frequency}"
 			)
 	
 	# Log summary
-	if processed_count > 0 or error_count > 0:
+	if invoices is None and (counts.processed > 0 or counts.errors > 0):
 		frappe.log_error(
 			title="Late Fine Scheduler Summary",
-			message=f"Processed: {processed_count}, Skipped: {skipped_count}, Errors: {error_count}"
+			message=f"Processed: {counts.processed}, Skipped: {counts.skipped}, Errors: {counts.errors}"
 		)
+	
+	return counts
 
 
-def add_late_fine_once(invoice_name, late_fine_amount, fee_schedule_name):
+def get_pending_late_fines(current_date, invoices=None):
+	"""Return the overdue draft invoices that owe late fine units as of current_date.
+	
+	Every invoice with a late fine stores the date its fines are billed through
+	(custom_late_fined_through, the due date until the first fine), so candidates are
+	an indexed range on that date. The units each one owes since then are worked out
+	in constant time per invoice by late_fine_accrual.calculate_accruals. Invoices
+	that are up to date, or have an unknown frequency, are not returned. Pass
+	invoices to only consider those names.
+	"""
+	if invoices is not None and not invoices:
+		return []
+	
+	candidates = frappe.db.sql("""
+		SELECT
+			si.name,
+			si.custom_late_fine_amount AS fine_amount,
+			IFNULL(NULLIF(si.custom_fine_frequency, ''), 'Once') AS fine_frequency,
+			si.due_date,
+			si.fee_schedule,
+			si.custom_late_fined_through AS fined_through
+		FROM `tabSales Invoice` si
+		WHERE si.custom_late_fined_through < %(current_date)s
+			AND si.docstatus = 0
+			AND si.custom_has_late_fine = 1
+			AND si.custom_late_fine_amount > 0
+			AND si.custom_payment_status IN ('Overdue', 'Unpaid')
+			AND si.due_date < %(current_date)s
+			AND IFNULL(NULLIF(si.custom_fine_frequency, ''), 'Once') IN %(frequencies)s
+			{invoice_condition}
+	""".format(
+		invoice_condition="AND si.name IN %(invoices)s" if invoices is not None else ""
+	), {"current_date": current_date, "frequencies": FINE_FREQUENCIES, "invoices": invoices}, as_dict=True)
+	
+	units = {d.name: d.units for d in calculate_accruals(candidates, current_date)}
+	pending_fines = []
+	for invoice_data in candidates:
+		if invoice_data.name in units:
+			invoice_data.units = units[invoice_data.name]
+			pending_fines.append(invoice_data)
+	return pending_fines
+
+
+def add_late_fine_once(invoice_name, late_fine_amount, fee_schedule_name, late_fine_item=None):
 	"""Add late fine item once to an invoice. Skip if already added.
 	
 	Only processes draft invoices (not submitted or cancelled).
@@ -115,25 +233,32 @@ def add_late_fine_once(invoice_name, late_fine_amount, fee_schedule_name):
 	if invoice_doc.docstatus != 0:
 		return False
 	
-	# Check if late fine item already exists
+	# Check if the late fine was already added (a Late Fine fee component doesn't count)
 	for item in invoice_doc.items:
-		if is_late_fine_item(item):
+		if is_late_fine_accrual(item):
 			# Late fine already added, skip
 			return False
 	
 	# Add late fine item directly (only draft invoices are processed)
-	_add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_name)
+	_add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_name, late_fine_item)
+	invoice_doc.custom_late_fined_through = today()
 	invoice_doc.save()
 	frappe.db.commit()
 	
 	return True
 
 
-def add_late_fine_daily(invoice_name, late_fine_amount, fee_schedule_name, due_date):
-	"""Add late fine amount each day for overdue invoices.
-	
-	For Daily frequency: adds fine amount each day the invoice is overdue.
+def add_late_fine_recurring(
+	invoice_name, late_fine_amount, fee_schedule_name, due_date, fine_frequency="Daily", units=None, late_fine_item=None
+):
+	"""Add late fine amount for each day, week or month an invoice is overdue.
+	
+	The units owed since the last fined date are accrued on the late fine row this
+	job added, whose qty is the number of days, weeks or months fined. A new row is
+	added when there is none yet or the fine amount has changed since, so earlier
+	units keep their rate; Late Fine fee component rows are never accrued on.
 	Only processes draft invoices (not submitted or cancelled).
+	Pass units when they are already known (see get_pending_late_fines).
 	"""
 	invoice_doc = frappe.get_doc("Sales Invoice", invoice_name)
 	
@@ -142,30 +267,33 @@ def add_late_fine_daily(invoice_name, late_fine_amount, fee_schedule_name, due_d
 		return False
 	
 	current_date = today()
-	current_date_obj = getdate(current_date)
 	
-	# Start from day after due date
-	start_date = getdate(due_date) + timedelta(days=1) if due_date else current_date_obj
-	
-	# Check if current date is past the start date
-	if current_date_obj < start_date:
-		# Not yet time to add fine
+	# Not overdue yet
+	if not due_date or getdate(current_date) <= getdate(due_date):
 		return False
 	
-	# Draft invoice - check if late fine item was added today
-	# Count existing late fine items
-	existing_items = [item for item in invoice_doc.items if is_late_fine_item(item)]
-	
-	# Calculate how many days we should have fines for
-	days_overdue = (current_date_obj - start_date).days + 1
-	
-	# If we have fewer items than days overdue, add items for missing days
-	items_to_add = days_overdue - len(existing_items)
-	
-	if items_to_add > 0:
-		# Add fine items for missing days (including today)
-		for day in range(items_to_add):
-			_add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_name)
+	if units is None:
+		units = fine_units_owed(fine_frequency, due_date, invoice_doc.custom_late_fined_through, current_date)
+	
+	if units > 0:
+		# Accrue the missing periods (including the current one) on the row billing the current amount
+		late_fine_row = next(
+			(
+				item for item in invoice_doc.items
+				if is_late_fine_accrual(item)
+				and flt(item.rate, item.precision("rate")) == flt(late_fine_amount, item.precision("rate"))
+			),
+			None,
+		)
+		if late_fine_row:
+			late_fine_row.qty = flt(late_fine_row.qty) + units
+			late_fine_row.amount = flt(late_fine_row.rate) * late_fine_row.qty
+			invoice_doc.calculate_taxes_and_totals()
+		else:
+			_add_late_fine_item_to_invoice(
+				invoice_doc, late_fine_amount, fee_schedule_name, late_fine_item, qty=units
+			)
+		invoice_doc.custom_late_fined_through = current_date
 		invoice_doc.save()
 		frappe.db.commit()
 	else:
@@ -184,8 +312,13 @@ def is_late_fine_item(item):
 	)
 
 
-def _add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_name):
-	"""Add a late fine item to an invoice document."""
+def is_late_fine_accrual(item):
+	"""Check if an item is a late fine row added by this job, not a fee component."""
+	return cint(item.get("custom_late_fine_accrual"))
+
+
+def get_late_fine_item(fee_schedule_name):
+	"""Return the item_code, item_name, description and discount to bill late fines of a Fee Schedule with."""
 	# Get fee schedule to find the late fine item if available
 	late_fine_component = None
 	if fee_schedule_name:
@@ -211,6 +344,19 @@ def _add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_n
 		if not item_code:
 			item_code = frappe.db.get_value("Item", {"item_code": "Late Fine"}, "name")
 	
+	return frappe._dict(
+		item_code=item_code,
+		item_name=item_name,
+		description=late_fine_component.description if late_fine_component else "Late Fine",
+		discount=late_fine_component.discount if late_fine_component else 0,
+	)
+
+
+def _add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_name, late_fine_item=None, qty=1):
+	"""Add a late fine item to an invoice document."""
+	late_fine_item = late_fine_item or get_late_fine_item(fee_schedule_name)
+	item_code = late_fine_item.item_code
+	
 	# Get income account from existing items or company defaults
 	income_account = None
 	if invoice_doc.items:
@@ -223,19 +369,20 @@ def _add_late_fine_item_to_invoice(invoice_doc, late_fine_amount, fee_schedule_n
 	# Create the item row
 	item_row = invoice_doc.append("items", {
 		"item_code": item_code,
-		"item_name": item_name if not item_code else None,
-		"description": late_fine_component.description if late_fine_component else "Late Fine",
-		"qty": 1,
+		"item_name": late_fine_item.item_name if not item_code else None,
+		"description": late_fine_item.description,
+		"qty": qty,
 		"rate": late_fine_amount,
-		"amount": late_fine_amount,
-		"income_account": income_account
+		"amount": late_fine_amount * qty,
+		"income_account": income_account,
+		"custom_late_fine_accrual": 1,
 	})
 	
 	# Set discount if available from component
-	if late_fine_component and late_fine_component.discount:
-		item_row.discount_percentage = late_fine_component.discount
+	if late_fine_item.discount:
+		item_row.discount_percentage = late_fine_item.discount
 		# Recalculate amount with discount
-		item_row.amount = late_fine_amount - (late_fine_amount * late_fine_component.discount / 100)
+		item_row.amount = (late_fine_amount - (late_fine_amount * late_fine_item.discount / 100)) * qty
 	
 	# Calculate totals
 	invoice_doc.calculate_taxes_and_totals()
@@ -259,30 +406,8 @@ def _create_late_fine_invoice_for_submitted(original_invoice_doc, late_fine_amou
 		# Late fine invoice already created today, skip
 		return
 	
-	# Get fee schedule to find the late fine item if available
-	late_fine_component = None
-	if fee_schedule_name:
-		try:
-			fee_schedule_doc = frappe.get_doc("Fee Schedule", fee_schedule_name)
-			for component in fee_schedule_doc.components:
-				if component.fees_category == "Late Fine" or "Late Fine" in (component.description or ""):
-					late_fine_component = component
-					break
-		except Exception:
-			pass
-	
-	# Determine item_code to use
-	item_code = None
-	item_name = "Late Fine"
-	
-	if late_fine_component and late_fine_component.item:
-		item_code = late_fine_component.item
-		item_name = late_fine_component.item
-	else:
-		# Try to find Late Fine item in Item master
-		item_code = frappe.db.get_value("Item", {"item_name": "Late Fine"}, "name")
-		if not item_code:
-			item_code = frappe.db.get_value("Item", {"item_code": "Late Fine"}, "name")
+	late_fine_item = get_late_fine_item(fee_schedule_name)
+	item_code = late_fine_item.item_code
 	
 	# Get income account
 	income_account = None
@@ -318,19 +443,20 @@ def _create_late_fine_invoice_for_submitted(original_invoice_doc, late_fine_amou
 	# Add the late fine item
 	item_row = late_fine_invoice.append("items", {
 		"item_code": item_code,
-		"item_name": item_name if not item_code else None,
-		"description": late_fine_component.description if late_fine_component else "Late Fine",
+		"item_name": late_fine_item.item_name if not item_code else None,
+		"description": late_fine_item.description,
 		"qty": 1,
 		"rate": late_fine_amount,
 		"amount": late_fine_amount,
-		"income_account": income_account
+		"income_account": income_account,
+		"custom_late_fine_accrual": 1,
 	})
 	
 	# Set discount if available from component
-	if late_fine_component and late_fine_component.discount:
-		item_row.discount_percentage = late_fine_component.discount
+	if late_fine_item.discount:
+		item_row.discount_percentage = late_fine_item.discount
 		# Recalculate amount with discount
-		item_row.amount = late_fine_amount - (late_fine_amount * late_fine_component.discount / 100)
+		item_row.amount = late_fine_amount - (late_fine_amount * late_fine_item.discount / 100)
 	
 	# Calculate totals
 	late_fine_invoice.calculate_taxes_and_totals()
@@ -0,0 +1,106 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import flt
+
+from eduction_override.fees.bulk_submit import post_gl_entries_in_bulk, submit_invoices
+from eduction_override.fees.fee_schedule_override import generate_fees
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+# Fields of ledger rows that differ between two submissions of the same invoices
+IGNORED_FIELDS = {"name", "creation", "modified", "owner", "modified_by", "idx", "voucher_detail_no"}
+
+
+class TestBulkSubmit(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=4, days_overdue=0)
+		cls.school.make()
+		cls.fee_schedule = cls.school.make_fee_schedules()[0]
+
+	@classmethod
+	def tearDownClass(cls):
+		delete_fee_invoices([cls.fee_schedule])
+		cls.school.delete()
+		super().tearDownClass()
+
+	def submit(self, bulk):
+		"""Generate and submit the schedule's invoices; return their ledgers and outstanding by student."""
+		delete_fee_invoices([self.fee_schedule])
+		generate_fees(self.fee_schedule)
+		invoices = frappe.get_all(
+			"Sales Invoice",
+			filters={"fee_schedule": self.fee_schedule},
+			fields=["name", "student"],
+			order_by="name",
+		)
+		self.assertEqual(len(invoices), 4, "Every student should get an invoice")
+
+		if bulk:
+			submitted, failures = submit_invoices([d.name for d in invoices])
+			self.assertFalse(failures, "Bulk submit should not fail")
+			self.assertEqual(len(submitted), 4, "Every invoice should be submitted")
+		else:
+			for d in invoices:
+				frappe.get_doc("Sales Invoice", d.name).submit()
+		frappe.db.commit()
+
+		# Invoice names differ between the two runs, so replace them with the student
+		students = {d.name: d.student for d in invoices}
+		result = {}
+		for d in invoices:
+			result[d.student] = {
+				"outstanding_amount": flt(frappe.db.get_value("Sales Invoice", d.name, "outstanding_amount")),
+				"GL Entry": self.get_ledger("GL Entry", d.name, students),
+				"Payment Ledger Entry": self.get_ledger("Payment Ledger Entry", d.name, students),
+			}
+		return result
+
+	def get_ledger(self, doctype, voucher_no, students):
+		rows = []
+		for row in frappe.get_all(doctype, filters={"voucher_no": voucher_no}, fields=["*"]):
+			rows.append({
+				key: students.get(value, value)
+				for key, value in row.items()
+				if key not in IGNORED_FIELDS and not key.startswith("_")
+			})
+		return sorted(rows, key=lambda d: (d["account"], flt(d.get("debit")), flt(d.get("credit")), flt(d.get("amount"))))
+
+	def test_bulk_submit_matches_submit(self):
+		"""Test that bulk posted ledger entries are the same as those of a normal submit"""
+		expected = self.submit(bulk=False)
+		actual = self.submit(bulk=True)
+
+		self.assertEqual(actual, expected, "GL and Payment Ledger Entries and outstanding should match")
+		for student, result in actual.items():
+			self.assertTrue(result["GL Entry"], f"Invoice of {student} should have GL Entries")
+			self.assertTrue(result["Payment Ledger Entry"], f"Invoice of {student} should have Payment Ledger Entries")
+
+	def test_bulk_posting_respects_frozen_date(self):
+		"""Test that bulk posted entries are rejected on or before the accounts frozen date"""
+		delete_fee_invoices([self.fee_schedule])
+		generate_fees(self.fee_schedule)
+		invoices = frappe.get_all("Sales Invoice", filters={"fee_schedule": self.fee_schedule}, pluck="name")
+
+		# Submit every invoice the way submit_invoices does after the first one
+		buffer = []
+		for name in invoices:
+			doc = frappe.get_doc("Sales Invoice", name)
+			doc.flags.gl_entry_buffer = buffer
+			doc.submit()
+		self.assertEqual(len(buffer), len(invoices), "Every GL map should be buffered")
+
+		posting_date = frappe.db.get_value("Sales Invoice", invoices[0], "posting_date")
+		frappe.db.set_single_value("Accounts Settings", "acc_frozen_upto", posting_date)
+		try:
+			self.assertRaises(frappe.ValidationError, post_gl_entries_in_bulk, buffer)
+		finally:
+			frappe.db.set_single_value("Accounts Settings", "acc_frozen_upto", None)
+			frappe.db.rollback()
+
+		self.assertFalse(
+			frappe.db.exists("GL Entry", {"voucher_no": ["in", invoices]}), "No GL Entries should be written"
+		)
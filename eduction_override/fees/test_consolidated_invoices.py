@@ -0,0 +1,81 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from eduction_override.fees.consolidated_invoices import generate_consolidated_invoices
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+
+class TestConsolidatedInvoices(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=3, days_overdue=0)
+		cls.school.make()
+		cls.bulk_run = cls.school.bulk_run.name
+		frappe.db.set_value("Bulk Fee Invoice Creation", cls.bulk_run, "consolidate_invoices", 1)
+		first = cls.school.make_fee_schedules()[0]
+
+		# A second schedule of the run billing the same students, e.g. for another term's fees
+		second = frappe.copy_doc(frappe.get_doc("Fee Schedule", first))
+		second.insert()
+		cls.school.track(second)
+		cls.school.submit_fee_schedules([second.name])
+		frappe.get_doc("Bulk Fee Invoice Creation", cls.bulk_run)._set_row_checkpoint(
+			{}, "Second Schedule", "Completed", fee_schedule=second.name
+		)
+		frappe.db.commit()
+
+		cls.fee_schedules = [first, second.name]
+		cls.statuses = {
+			name: frappe.db.get_value("Fee Schedule", name, "status") for name in cls.fee_schedules
+		}
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.school.delete()
+		super().tearDownClass()
+
+	def tearDown(self):
+		delete_fee_invoices(self.fee_schedules)
+		for name, status in self.statuses.items():
+			frappe.db.set_value("Fee Schedule", name, "status", status)
+		frappe.db.commit()
+
+	def test_one_invoice_per_student(self):
+		"""Test that every student gets one invoice with the items of every schedule of the run"""
+		generate_consolidated_invoices(self.bulk_run)
+
+		invoices = frappe.get_all(
+			"Sales Invoice",
+			filters={"fee_schedule": ["in", self.fee_schedules], "docstatus": 0},
+			fields=["name", "student"],
+		)
+		self.assertEqual(len(invoices), 3, "Every student should get an invoice")
+		self.assertEqual(len({d.student for d in invoices}), 3, "No student should get a second invoice")
+		for invoice in invoices:
+			item_schedules = frappe.get_all(
+				"Sales Invoice Item", filters={"parent": invoice.name}, pluck="custom_fee_schedule"
+			)
+			self.assertEqual(
+				set(item_schedules), set(self.fee_schedules), "Items should come from both schedules"
+			)
+
+		for name in self.fee_schedules:
+			self.assertEqual(frappe.db.get_value("Fee Schedule", name, "status"), "Invoice Created")
+
+	def test_run_is_not_billed_twice(self):
+		"""Test that neither the run nor one of its schedules can bill the students again"""
+		generate_consolidated_invoices(self.bulk_run)
+
+		self.assertRaises(frappe.ValidationError, generate_consolidated_invoices, self.bulk_run)
+		self.assertRaises(
+			frappe.ValidationError, frappe.get_doc("Fee Schedule", self.fee_schedules[0]).create_fees
+		)
+		self.assertEqual(
+			frappe.db.count("Sales Invoice", {"fee_schedule": ["in", self.fee_schedules], "docstatus": 0}),
+			3,
+			"No invoices should be added",
+		)
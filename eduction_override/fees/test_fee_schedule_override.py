@@ -0,0 +1,125 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from eduction_override.fees import fee_schedule_override
+from eduction_override.fees.fee_schedule_override import generate_fees, generate_fees_shard
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+
+class TestFeeScheduleOverride(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=6, days_overdue=0)
+		cls.school.make()
+		cls.fee_schedule = cls.school.make_fee_schedules()[0]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.school.delete()
+		super().tearDownClass()
+
+	def setUp(self):
+		# Two batches of three students
+		frappe.local.conf.fee_invoice_commit_batch_size = 3
+
+	def tearDown(self):
+		for key in ("fee_invoice_commit_batch_size", "fee_invoice_shard_size"):
+			frappe.local.conf.pop(key, None)
+		delete_fee_invoices([self.fee_schedule])
+
+	def get_invoiced_students(self):
+		return frappe.get_all(
+			"Sales Invoice",
+			filters={"fee_schedule": self.fee_schedule, "docstatus": ["<", 2]},
+			pluck="student",
+		)
+
+	def test_rerun_after_failed_batch(self):
+		"""Test that running a schedule again after a failed batch bills every student once"""
+		create_student_invoice = fee_schedule_override.create_student_invoice
+		attempted = []
+
+		def fail_second_batch(builder, student, failures, name=None):
+			attempted.append(student.student)
+			if len(attempted) > 3:
+				raise frappe.ValidationError("Worker stopped")
+			return create_student_invoice(builder, student, failures, name=name)
+
+		with patch.object(fee_schedule_override, "create_student_invoice", fail_second_batch):
+			self.assertRaises(frappe.ValidationError, generate_fees, self.fee_schedule)
+		frappe.db.rollback()
+		self.assertEqual(len(self.get_invoiced_students()), 3, "The first batch should stay committed")
+
+		frappe.db.set_value("Fee Schedule", self.fee_schedule, "status", "Failed")
+		generate_fees(self.fee_schedule)
+
+		students = self.get_invoiced_students()
+		self.assertEqual(len(students), 6, "Every student should get an invoice")
+		self.assertEqual(len(set(students)), 6, "No student should get a second invoice")
+		self.assertEqual(
+			frappe.db.get_value("Fee Schedule", self.fee_schedule, ["status", "custom_invoices_created"]),
+			("Invoice Created", 6),
+			"The schedule should count the invoices of both runs",
+		)
+
+	def enqueue_shards(self):
+		"""Generate the schedule in shards of four students; return the arguments of the queued shard jobs."""
+		frappe.local.conf.fee_invoice_shard_size = 4
+		frappe.db.set_value("Fee Schedule", self.fee_schedule, "status", "In Process")
+		with patch.object(frappe, "enqueue") as enqueue:
+			generate_fees(self.fee_schedule)
+		return [call.kwargs for call in enqueue.call_args_list]
+
+	def run_shard(self, shard):
+		generate_fees_shard(
+			shard["fee_schedule"], shard["students"], shard["total_students"], user=shard["user"]
+		)
+
+	def get_shard_counts(self):
+		return frappe.db.get_value(
+			"Fee Schedule",
+			self.fee_schedule,
+			["status", "custom_invoices_created", "custom_invoice_errors", "custom_invoice_shards_completed"],
+		)
+
+	def test_sharded_generation(self):
+		"""Test that a sharded schedule bills every student once and is finalized by its last shard"""
+		shards = self.enqueue_shards()
+		self.assertEqual([len(d["students"]) for d in shards], [4, 2], "Students should be split into shards")
+
+		self.run_shard(shards[0])
+		self.assertEqual(
+			self.get_shard_counts(), ("In Process", 4, 0, 1), "The first shard should only add its counts"
+		)
+
+		self.run_shard(shards[1])
+		students = self.get_invoiced_students()
+		self.assertEqual(len(students), 6, "Every student should get an invoice")
+		self.assertEqual(len(set(students)), 6, "No student should get a second invoice")
+		self.assertEqual(
+			self.get_shard_counts(), ("Invoice Created", 6, 0, 2), "The last shard should finalize"
+		)
+
+	def test_failed_shard(self):
+		"""Test that the students of a shard that stops are counted as errors and the schedule is finalized"""
+		shards = self.enqueue_shards()
+		self.run_shard(shards[0])
+		with patch.object(
+			fee_schedule_override, "FeeInvoiceBuilder", side_effect=frappe.ValidationError("Worker stopped")
+		):
+			self.run_shard(shards[1])
+
+		self.assertEqual(
+			self.get_shard_counts(), ("Failed", 4, 2, 2), "The shard's students should be errors"
+		)
+		self.assertEqual(
+			frappe.db.count("Fee Invoice Failure", {"fee_schedule": self.fee_schedule, "status": "Open"}),
+			2,
+			"The shard's students should be recorded for a retry",
+		)
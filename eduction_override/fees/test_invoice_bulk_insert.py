@@ -0,0 +1,86 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import re
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from eduction_override.fees.fee_schedule_override import generate_fees
+from eduction_override.fees.invoice_bulk_insert import check_bulk_inserted_invoices
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+# Fields that legitimately differ between two generations of the same schedule
+IGNORED_FIELDS = {"posting_time"}
+
+
+class TestInvoiceBulkInsert(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=6, days_overdue=0)
+		cls.school.make()
+		cls.fee_schedule = cls.school.make_fee_schedules()[0]
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.school.delete()
+		super().tearDownClass()
+
+	def setUp(self):
+		# Two batches, so the second one can be written as copies of the first invoice
+		frappe.local.conf.fee_invoice_commit_batch_size = 3
+
+	def tearDown(self):
+		for key in ("fee_invoice_commit_batch_size", "fee_invoice_fast_path"):
+			frappe.local.conf.pop(key, None)
+		delete_fee_invoices([self.fee_schedule])
+
+	def get_invoice_names(self):
+		return frappe.get_all(
+			"Sales Invoice", filters={"fee_schedule": self.fee_schedule}, pluck="name", order_by="name"
+		)
+
+	def generate(self, fast_path):
+		"""Generate the schedule's invoices and return them by student, without per-run fields."""
+		frappe.local.conf.fee_invoice_fast_path = fast_path
+		generate_fees(self.fee_schedule)
+
+		invoices = {}
+		for name in self.get_invoice_names():
+			invoice = frappe.get_doc("Sales Invoice", name).as_dict(no_default_fields=True)
+			for d in [invoice, *invoice["items"], *invoice.get("payment_schedule", [])]:
+				for fieldname in IGNORED_FIELDS:
+					d.pop(fieldname, None)
+			invoices[invoice.student] = invoice
+		return invoices
+
+	def test_fast_path_matches_orm_path(self):
+		"""Test that bulk inserted invoices are the same as invoices saved one by one"""
+		expected = self.generate(fast_path=0)
+		delete_fee_invoices([self.fee_schedule])
+
+		actual = self.generate(fast_path=1)
+		self.assertEqual(len(actual), 6, "Every student should get an invoice")
+		self.assertEqual(actual, expected, "Fast path invoices and child rows should match the ORM path")
+
+		# Names come from the naming series: one prefix, consecutive numbers, counter moved past them
+		names = self.get_invoice_names()
+		parts = [re.match(r"^(.*?)(\d+)$", name).groups() for name in names]
+		prefix = parts[0][0]
+		numbers = [int(number) for _, number in parts]
+		self.assertEqual({p for p, _ in parts}, {prefix}, "All names should share the series prefix")
+		self.assertEqual(numbers, list(range(numbers[0], numbers[0] + len(names))), "Names should be consecutive")
+		self.assertGreaterEqual(
+			frappe.db.get_value("Series", prefix, "current"), numbers[-1], "Series counter should cover the names"
+		)
+
+	def test_check_rejects_bad_batch(self):
+		"""Test that a bulk inserted batch that doesn't add up is rejected"""
+		self.generate(fast_path=1)
+		names = self.get_invoice_names()
+		representative = frappe.get_doc("Sales Invoice", names[0])
+		check_bulk_inserted_invoices(representative, names[3:])
+
+		frappe.db.set_value("Sales Invoice", names[-1], "grand_total", representative.grand_total + 1)
+		self.assertRaises(frappe.ValidationError, check_bulk_inserted_invoices, representative, names[3:])
@@ -0,0 +1,50 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+import datetime
+import unittest
+
+from eduction_override.fees.late_fine_accrual import add_months, calculate_accruals, fine_units_owed
+
+
+class TestLateFineAccrual(unittest.TestCase):
+	def test_fine_units_owed(self):
+		"""Test that late fine units owed are worked out for every fine frequency"""
+		due_date = "2026-01-31"
+		self.assertEqual(fine_units_owed("Once", due_date, None, "2026-01-31"), 0, "Not overdue on the due date")
+		self.assertEqual(fine_units_owed("Once", due_date, None, "2026-06-01"), 1, "Once fines a single unit")
+		self.assertEqual(fine_units_owed("Once", due_date, "2026-02-01", "2026-06-01"), 0, "Once is not fined again")
+		self.assertEqual(fine_units_owed("Daily", due_date, None, "2026-02-10"), 10, "One unit per day overdue")
+		self.assertEqual(fine_units_owed("Daily", due_date, "2026-02-08", "2026-02-10"), 2, "Only the missing days")
+		self.assertEqual(fine_units_owed("Weekly", due_date, None, "2026-02-07"), 1, "A started week is fined")
+		self.assertEqual(fine_units_owed("Weekly", due_date, "2026-02-07", "2026-02-08"), 1, "Second week")
+		self.assertEqual(fine_units_owed("Weekly", due_date, "2026-02-08", "2026-02-14"), 0, "Same week again")
+		self.assertEqual(fine_units_owed("Monthly", due_date, None, "2026-02-28"), 1, "First month")
+		self.assertEqual(fine_units_owed("Monthly", due_date, "2026-02-28", "2026-03-01"), 1, "Month after Feb 28")
+		self.assertEqual(fine_units_owed("Monthly", due_date, None, "2027-01-31"), 12, "A year of months")
+
+	def test_fined_through_after_today(self):
+		"""Test that nothing is owed when fines are already billed past the date"""
+		for frequency in ("Once", "Daily", "Weekly", "Monthly"):
+			self.assertEqual(
+				fine_units_owed(frequency, "2026-01-31", "2026-03-15", "2026-03-01"), 0, f"{frequency} owes nothing"
+			)
+
+	def test_add_months_clamps_to_month_end(self):
+		"""Test that month periods from a month-end due date end on the last day of shorter months"""
+		self.assertEqual(add_months(datetime.date(2026, 1, 31), 1), datetime.date(2026, 2, 28), "Non-leap February")
+		self.assertEqual(add_months(datetime.date(2028, 1, 31), 1), datetime.date(2028, 2, 29), "Leap February")
+		self.assertEqual(add_months(datetime.date(2026, 1, 31), 3), datetime.date(2026, 4, 30), "30 day month")
+		self.assertEqual(add_months(datetime.date(2026, 11, 30), 2), datetime.date(2027, 1, 30), "Across the year")
+		self.assertEqual(fine_units_owed("Monthly", "2028-01-31", None, "2028-02-29"), 1, "Leap month not complete")
+		self.assertEqual(fine_units_owed("Monthly", "2028-01-31", None, "2028-03-01"), 2, "Second leap month")
+
+	def test_calculate_accruals(self):
+		"""Test that a list of invoices only returns those owing fines, with their amounts"""
+		due_date = "2026-01-31"
+		invoices = [
+			{"name": "A", "fine_frequency": "Weekly", "due_date": due_date, "fined_through": None, "fine_amount": 5},
+			{"name": "B", "fine_frequency": "Monthly", "due_date": due_date, "fined_through": "2026-02-01", "fine_amount": 5},
+		]
+		accruals = calculate_accruals(invoices, "2026-02-15")
+		self.assertEqual([(d.name, d.units, d.amount) for d in accruals], [("A", 3, 15)], "Only invoices owing fines")
@@ -0,0 +1,101 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from eduction_override.fees.bulk_submit import submit_fee_invoices, submit_invoice_chunk, submit_invoices
+from eduction_override.fees.fee_schedule_override import generate_fees
+from eduction_override.fees.notifications import process_fee_notifications
+from eduction_override.tests.utils import SyntheticSchool, delete_fee_invoices
+
+# Arguments of frappe.enqueue that are not passed on to the job
+ENQUEUE_ARGS = {"queue", "timeout", "enqueue_after_commit"}
+
+
+class TestFeeNotifications(FrappeTestCase):
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.school = SyntheticSchool(programs=1, sections=1, students=3, days_overdue=0)
+		cls.school.make()
+		cls.fee_schedule = cls.school.make_fee_schedules()[0]
+		frappe.db.set_value("Fee Schedule", cls.fee_schedule, "send_email", 1)
+		frappe.db.commit()
+
+	@classmethod
+	def tearDownClass(cls):
+		cls.school.delete()
+		super().tearDownClass()
+
+	def setUp(self):
+		generate_fees(self.fee_schedule)
+		self.invoices = frappe.get_all(
+			"Sales Invoice", filters={"fee_schedule": self.fee_schedule}, pluck="name"
+		)
+
+	def tearDown(self):
+		frappe.local.conf.pop("fee_invoice_submit_chunk_size", None)
+		frappe.db.delete(
+			"Email Queue", {"reference_doctype": "Sales Invoice", "reference_name": ["in", self.invoices]}
+		)
+		delete_fee_invoices([self.fee_schedule])
+
+	def test_only_submitted_invoices_are_emailed(self):
+		"""Test that students are emailed their submitted invoices once"""
+		self.assertEqual(
+			process_fee_notifications(fee_schedule=self.fee_schedule), 0, "Drafts should not be emailed"
+		)
+
+		submit_invoices(self.invoices)
+		frappe.db.commit()
+		self.assertEqual(
+			process_fee_notifications(fee_schedule=self.fee_schedule), 3, "Every student should be emailed"
+		)
+		self.assertEqual(
+			frappe.db.count(
+				"Sales Invoice", {"name": ["in", self.invoices], "custom_fee_notification_sent": 1}
+			),
+			3,
+			"Emailed invoices should be flagged",
+		)
+		self.assertEqual(
+			frappe.db.count(
+				"Email Queue", {"reference_doctype": "Sales Invoice", "reference_name": ["in", self.invoices]}
+			),
+			3,
+			"One email per student should be queued",
+		)
+
+		self.assertEqual(
+			process_fee_notifications(fee_schedule=self.fee_schedule), 0, "No one should be emailed twice"
+		)
+
+	def test_last_submit_chunk_queues_notifications(self):
+		"""Test that the notifications are queued once, by the last chunk of a bulk submit"""
+		frappe.local.conf.fee_invoice_submit_chunk_size = 2
+		with patch.object(frappe, "enqueue") as enqueue:
+			submit_fee_invoices(fee_schedule=self.fee_schedule)
+		chunks = [call.kwargs for call in enqueue.call_args_list]
+		self.assertEqual(len(chunks), 2, "The invoices should be submitted in two chunks")
+
+		with patch.object(frappe, "enqueue") as enqueue:
+			for chunk in chunks:
+				self.assertFalse(enqueue.called, "Notifications should wait for the last chunk")
+				submit_invoice_chunk(
+					**{key: value for key, value in chunk.items() if key not in ENQUEUE_ARGS}
+				)
+
+		self.assertEqual(
+			[call.args[0] for call in enqueue.call_args_list],
+			["eduction_override.fees.notifications.process_fee_notifications"],
+			"The last chunk should queue the notifications",
+		)
+		self.assertEqual(enqueue.call_args.kwargs["fee_schedule"], self.fee_schedule)
+		self.assertEqual(
+			frappe.db.count("Sales Invoice", {"name": ["in", self.invoices], "docstatus": 1}),
+			3,
+			"Every invoice should be submitted",
+		)
@@ -43,7 +43,7 @@ required_apps = ["education","erpnext"]
 # page_js = {"page" : "public/js/file.js"}
 
 # include js in doctype views
-# doctype_js = {"doctype" : "public/js/doctype.js"}
+doctype_js = {"Fee Schedule" : "public/js/fee_schedule.js"}
 doctype_list_js = {"Sales Invoice" : "eduction_override.accounts.doctype.sales_invoice.sales_invoice_list"}
 # doctype_tree_js = {"doctype" : "public/js/doctype_tree.js"}
 # doctype_calendar_js = {"doctype" : "public/js/doctype_calendar.js"}
@@ -140,6 +140,17 @@ doctype_list_js = {"Sales Invoice" : "eduction_override.accounts.doctype.sales_i
 # 	}
 # }
 
+doc_events = {
+	"Student Group": {
+		"on_update": "eduction_override.fees.student_counts.clear_student_group_cache",
+		"on_trash": "eduction_override.fees.student_counts.clear_student_group_cache"
+	},
+	"Student Group Student": {
+		"on_update": "eduction_override.fees.student_counts.clear_student_group_cache",
+		"on_trash": "eduction_override.fees.student_counts.clear_student_group_cache"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
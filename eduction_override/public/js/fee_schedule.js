@@ -0,0 +1,63 @@
+// Copyright (c) 2024, Eduction Override and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Fee Schedule', {
+	onload: function(frm) {
+		// Results of the background jobs started by "Submit Invoices"
+		frappe.realtime.off('fee_invoice_submit_progress');
+		frappe.realtime.on('fee_invoice_submit_progress', function(data) {
+			frappe.show_alert({
+				message: __('{0} invoices submitted, {1} failed', [data.submitted, data.failed]),
+				indicator: data.failed ? 'orange' : 'green'
+			});
+		});
+	},
+	
+	refresh: function(frm) {
+		if (frm.doc.docstatus === 1 && frm.doc.status === 'Failed') {
+			frm.add_custom_button(__('Retry Failed Invoices'), function() {
+				frappe.call({
+					method: 'eduction_override.fees.doctype.fee_invoice_failure.fee_invoice_failure.retry_failed_invoices',
+					args: { fee_schedule: frm.doc.name },
+					freeze: true,
+					callback: function() {
+						frappe.show_alert({ message: __('Retrying failed invoices in the background'), indicator: 'blue' });
+					}
+				});
+			});
+			frm.add_custom_button(__('Invoice Failures'), function() {
+				frappe.set_route('List', 'Fee Invoice Failure', { fee_schedule: frm.doc.name, status: 'Open' });
+			});
+		}
+		
+		if (frm.doc.docstatus === 1 && frm.doc.status === 'Invoice Created') {
+			frm.add_custom_button(__('Submit Invoices'), function() {
+				frappe.confirm(__('Submit all draft invoices of this Fee Schedule?'), function() {
+					frappe.call({
+						method: 'eduction_override.fees.bulk_submit.submit_fee_invoices',
+						args: { fee_schedule: frm.doc.name },
+						freeze: true,
+						callback: function(r) {
+							if (r.message) {
+								frappe.msgprint(__('Submitting {0} invoices in {1} background jobs', [r.message.invoices, r.message.chunks]));
+							}
+						}
+					});
+				});
+			});
+			
+			if (frm.doc.send_email) {
+				frm.add_custom_button(__('Send Fee Emails'), function() {
+					frappe.call({
+						method: 'eduction_override.fees.notifications.send_fee_notifications',
+						args: { fee_schedule: frm.doc.name },
+						freeze: true,
+						callback: function() {
+							frappe.show_alert({ message: __('Fee emails will be queued in the background'), indicator: 'blue' });
+						}
+					});
+				});
+			}
+		}
+	}
+});
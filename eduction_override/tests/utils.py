@@ -0,0 +1,182 @@
+# Copyright (c) 2024, Eduction Override and contributors
+# For license information, please see license.txt
+
+"""Synthetic fee billing data shared by the tests and the benchmark (fees/benchmark.py)."""
+
+import frappe
+from frappe.utils import add_days, today
+
+
+class SyntheticSchool:
+	"""Programs x sections x students, enrolled for one academic year, plus a run to bill them."""
+
+	def __init__(self, programs, sections, students, days_overdue, fee_structure=None, company=None, academic_year=None):
+		self.programs = programs
+		self.sections = sections
+		self.students = students
+		self.days_overdue = days_overdue
+		self.template_fee_structure = fee_structure or frappe.db.get_value(
+			"Fee Structure", {"docstatus": 1}, "name", order_by="creation desc"
+		)
+		if not self.template_fee_structure:
+			frappe.throw("The benchmark needs a submitted Fee Structure to copy")
+
+		self.company = company or frappe.db.get_value("Fee Structure", self.template_fee_structure, "company")
+		self.academic_year = (
+			academic_year
+			or frappe.db.get_single_value("Education Settings", "current_academic_year")
+			or frappe.db.get_value("Academic Year", {}, "name", order_by="year_start_date desc")
+		)
+		self.prefix = f"BENCH-{frappe.generate_hash(length=5).upper()}"
+		# Names of every document created, by doctype, for delete()
+		self.created = {}
+
+	def make(self):
+		"""Create the programs, students, enrollments, sections and the bulk run."""
+		fee_structure = frappe.copy_doc(frappe.get_doc("Fee Structure", self.template_fee_structure))
+		fee_structure.academic_year = self.academic_year
+		fee_structure.insert()
+		fee_structure.submit()
+		self.track(fee_structure)
+
+		due_date = add_days(today(), -self.days_overdue)
+		self.bulk_run = frappe.get_doc({
+			"doctype": "Bulk Fee Invoice Creation",
+			"fee_structure": fee_structure.name,
+			"company": self.company,
+			"posting_date": add_days(due_date, -30),
+			"due_date": due_date,
+			"allow_late_fine": 1,
+			"fine_frequency": "Daily",
+			"late_fine_amount": 10,
+		}).insert()
+		self.track(self.bulk_run)
+
+		from eduction_override.fees.doctype.bulk_fee_invoice_creation_row.bulk_fee_invoice_creation_row import (
+			save_row,
+		)
+
+		for p in range(self.programs):
+			program = self.track(frappe.get_doc({
+				"doctype": "Program",
+				"program_name": f"{self.prefix} Program {p + 1}",
+			}).insert())
+
+			section_names = []
+			for s in range(self.sections):
+				students = [self.make_student(program.name, p, s, i) for i in range(self.students)]
+				group = self.track(frappe.get_doc({
+					"doctype": "Student Group",
+					"student_group_name": f"{self.prefix} {p + 1}-{s + 1}",
+					"group_based_on": "Batch",
+					"program": program.name,
+					"academic_year": self.academic_year,
+					"students": [
+						{"student": d.name, "student_name": d.student_name, "active": 1} for d in students
+					],
+				}).insert())
+				section_names.append(group.name)
+
+			self.track_name("Bulk Fee Invoice Creation Row", save_row(self.bulk_run.name, program.name, section_names))
+
+		frappe.db.commit()
+
+	def make_student(self, program, p, s, i):
+		student = self.track(frappe.get_doc({
+			"doctype": "Student",
+			"first_name": f"{self.prefix}",
+			"last_name": f"{p + 1}-{s + 1}-{i + 1}",
+			"student_email_id": f"{self.prefix}-{p + 1}-{s + 1}-{i + 1}@example.com".lower(),
+		}).insert())
+
+		enrollment = frappe.get_doc({
+			"doctype": "Program Enrollment",
+			"student": student.name,
+			"student_name": student.student_name,
+			"program": program,
+			"academic_year": self.academic_year,
+			"enrollment_date": today(),
+		}).insert()
+		enrollment.submit()
+		self.track(enrollment)
+		return student
+
+	def make_fee_schedules(self):
+		"""Create and submit the run's Fee Schedules, without measuring; returns their names."""
+		doc = frappe.get_doc("Bulk Fee Invoice Creation", self.bulk_run.name)
+		fee_schedules = doc.create_fee_schedules(run_in_background=0)["schedules"]
+		frappe.db.commit()
+		for name in fee_schedules:
+			self.track_name("Fee Schedule", name)
+		self.submit_fee_schedules(fee_schedules)
+		return fee_schedules
+
+	def submit_fee_schedules(self, fee_schedules):
+		"""Submit the Fee Schedules, as invoices are only generated for submitted ones."""
+		for name in fee_schedules:
+			frappe.get_doc("Fee Schedule", name).submit()
+		frappe.db.commit()
+
+	def track(self, doc):
+		self.track_name(doc.doctype, doc.name)
+		return doc
+
+	def track_name(self, doctype, name):
+		self.created.setdefault(doctype, []).append(name)
+
+	def delete(self):
+		"""Delete everything the benchmark created, including the students' customers and users."""
+		frappe.db.rollback()
+
+		students = self.created.get("Student") or []
+		if students:
+			for student in frappe.get_all(
+				"Student", filters={"name": ["in", students]}, fields=["customer", "user"]
+			):
+				if student.customer:
+					self.track_name("Customer", student.customer)
+				if student.user:
+					self.track_name("User", student.user)
+
+		self.created["Bulk Fee Invoice Creation Row"] = frappe.get_all(
+			"Bulk Fee Invoice Creation Row",
+			filters={"bulk_fee_invoice_creation": self.bulk_run.name},
+			pluck="name",
+		) if getattr(self, "bulk_run", None) else []
+
+		# Dependents first
+		for doctype in (
+			"Sales Invoice",
+			"Fee Schedule",
+			"Bulk Fee Invoice Creation Row",
+			"Bulk Fee Invoice Creation",
+			"Student Group",
+			"Program Enrollment",
+			"Student",
+			"Customer",
+			"User",
+			"Program",
+			"Fee Structure",
+		):
+			delete_documents(doctype, self.created.get(doctype))
+		frappe.db.commit()
+
+
+def delete_documents(doctype, names):
+	"""Delete documents and their child rows directly, whatever their docstatus."""
+	if not names:
+		return
+	for df in frappe.get_meta(doctype).get_table_fields():
+		frappe.db.delete(df.options, {"parent": ["in", names], "parenttype": doctype})
+	frappe.db.delete(doctype, {"name": ["in", names]})
+
+
+def delete_fee_invoices(fee_schedules):
+	"""Delete the Sales Invoices of fee_schedules with their ledger entries and invoice failures."""
+	names = frappe.get_all("Sales Invoice", filters={"fee_schedule": ["in", fee_schedules]}, pluck="name")
+	if names:
+		for doctype in ("GL Entry", "Payment Ledger Entry"):
+			frappe.db.delete(doctype, {"voucher_no": ["in", names]})
+		delete_documents("Sales Invoice", names)
+	frappe.db.delete("Fee Invoice Failure", {"fee_schedule": ["in", fee_schedules]})
+	frappe.db.commit()